@@ -0,0 +1,382 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+
+import lfs_eeg
+from docview import DocView
+from negation import NEGATION_TRIGGERS, tokenize
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+OPENI_DIR = os.path.join(REPO_DIR, 'openi_demo')
+DEFAULT_CSV = os.path.join(OPENI_DIR, 'data', 'train_entries.csv')
+
+######################################################################################################
+##### SYNTHETIC EEG IMPRESSIONS
+######################################################################################################
+
+# Sentences impressions are assembled from, hitting none, some or several
+# of the impression terms
+IMPRESSION_SENTENCES = [
+    'This is a normal EEG in the awake and drowsy states.',
+    'No epileptiform discharges were seen during the recording.',
+    'Abnormal continuous video EEG due to frequent left temporal spike-wave discharges.',
+    'Background slowing is non-specific as to etiology.',
+    'There were no seizures recorded and no clinical events were pushed.',
+    'Excessive beta activity is likely a medication effect.',
+    'Several subclinical electrographic seizures arising from the right hemisphere.',
+    'The posterior dominant rhythm reaches 9 Hz and is reactive to eye opening.',
+    'Photic stimulation produced a symmetric driving response.',
+    'Sleep architecture with vertex waves and spindles was observed.',
+    'Clinical correlation is recommended.',
+    'Compared to the prior study there is interval improvement.',
+]
+
+def synthetic_impressions(n, min_sentences=1, max_sentences=8, seed=0):
+    """
+    n impression texts of random sentences from IMPRESSION_SENTENCES
+    """
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(IMPRESSION_SENTENCES)
+                     for _ in range(rng.randint(min_sentences, max_sentences)))
+            for _ in range(n)]
+
+######################################################################################################
+##### SYNTHETIC REPORTS
+######################################################################################################
+
+# Sentence frames without any LF vocabulary
+FILLER_SENTENCES = [
+    'Comparison is made to the prior examination',
+    'The study is limited by patient positioning',
+    'Heart size and pulmonary vascularity are within normal limits',
+    'Soft tissues are unremarkable',
+    'The visualized osseous structures are intact',
+    'Findings were discussed with the referring physician',
+    'Technique: standard views were obtained',
+    'Clinical history is provided as XXXX',
+]
+
+# Frames a vocabulary term is inserted into
+TERM_FRAMES = [
+    'There is {term} in the left upper region',
+    'Stable {term} is again seen',
+    '{trigger} evidence of {term}',
+    '{trigger} acute {term} is identified',
+    'Findings may represent {term}',
+    'Interval development of mild {term}',
+]
+
+def pattern_terms(pattern):
+    """
+    Plain phrases of a simple '|'-alternation pattern, with \\s as spaces
+    """
+    return [term.replace('\\s', ' ') for term in pattern.split('|')]
+
+class ReportGenerator(object):
+    """
+    Synthetic reports built from filler sentences and sentences mentioning
+    terms from an LF vocabulary. term_density is the fraction of sentences
+    mentioning a term; half of the frames put a negation trigger in front
+    of it, so negation windows are exercised too.
+    """
+
+    def __init__(self, vocabulary, term_density=0.3, seed=0):
+        self.vocabulary = list(vocabulary)
+        self.term_density = term_density
+        self.rng = random.Random(seed)
+
+    def sentence(self):
+        rng = self.rng
+        if self.vocabulary and rng.random() < self.term_density:
+            frame = rng.choice(TERM_FRAMES)
+            return frame.format(term=rng.choice(self.vocabulary),
+                                trigger=rng.choice(NEGATION_TRIGGERS))
+        return rng.choice(FILLER_SENTENCES)
+
+    def report(self, n_sentences):
+        return '. '.join(self.sentence() for _ in range(n_sentences)) + '.'
+
+    def reports(self, n, min_sentences=4, max_sentences=16):
+        return [self.report(self.rng.randint(min_sentences, max_sentences)) for _ in range(n)]
+
+def load_csv_texts(csv_path=DEFAULT_CSV, limit=None):
+    """
+    Report texts of a bundled OpenI CSV
+    """
+    with open(csv_path) as fin:
+        texts = [row['text'] for row in csv.DictReader(fin)]
+    return texts[:limit] if limit else texts
+
+######################################################################################################
+##### DOCUMENT ADAPTERS
+######################################################################################################
+
+class _Sentence(object):
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+class HCTReport(object):
+    """
+    Stand-in for the head CT candidates lfs_hct expects
+    (report.report.sentences[i].text)
+    """
+
+    def __init__(self, text):
+        self.report_text = DocView(text)
+        self.report = self
+        self.sentences = [_Sentence(s) for s in text.split('.')]
+
+class EEGReport(object):
+    """
+    Stand-in for the EEGNote objects lfs_eeg expects, with the report as
+    its interpretation and its last sentences as the findings' impression
+    """
+
+    def __init__(self, text):
+        sentences = text.split('. ')
+        self.sections = {
+            'interpretation': {'text': text},
+            'findings': {'impression': '. '.join(sentences[-2:])},
+        }
+
+######################################################################################################
+##### SUITES
+######################################################################################################
+
+def _openi_module():
+    if OPENI_DIR not in sys.path:
+        sys.path.insert(0, OPENI_DIR)
+    import labeling_functions
+    return labeling_functions
+
+def _lfs_of(module, prefix='LF_'):
+    return [value for name, value in sorted(vars(module).items())
+            if name.startswith(prefix) and callable(value)]
+
+def load_suite(name):
+    """
+    (lfs, vocabulary, make_doc) of LF suite name
+    """
+    if name == 'openi':
+        module = _openi_module()
+        return _lfs_of(module), module.categories + module.abnormal_mesh_terms, DocView
+    if name == 'cxr':
+        import lfs_cxr
+        return _lfs_of(lfs_cxr), lfs_cxr.categories + lfs_cxr.abnormal_disease_terms, DocView
+    if name == 'msk':
+        import lfs_msk
+        vocabulary = lfs_msk.disease_categories + ['fracture', 'lesion', 'mass', 'screw', 'degenerative spine']
+        return _lfs_of(lfs_msk), vocabulary, DocView
+    if name == 'hct':
+        import lfs_hct
+        return _lfs_of(lfs_hct), ['hemorrhage', 'hematoma', 'scalp hematoma'], HCTReport
+    if name == 'eeg':
+        vocabulary = (pattern_terms(lfs_eeg.SEIZURE_SYNONYMS) + lfs_eeg.NORMAL_IMPRESSION_TERMS
+                      + lfs_eeg.ABNORMAL_IMPRESSION_TERMS + ['abnormal', 'spike'])
+        try:
+            # Keep the spaCy load out of the timings
+            lfs_eeg.get_spacy_en()
+        except (ImportError, OSError):
+            pass
+        return _lfs_of(lfs_eeg, 'lf_'), vocabulary, EEGReport
+    raise ValueError(f'Unknown LF suite: {name}')
+
+SUITES = ['openi', 'cxr', 'msk', 'hct', 'eeg']
+
+# Suites the bundled chest X-ray CSV texts are meaningful for
+CSV_SUITES = ['openi', 'cxr', 'msk', 'hct']
+
+######################################################################################################
+##### TIMING
+######################################################################################################
+
+def time_per_item(fn, items, repeat=5):
+    """
+    Best-of-repeat seconds per item of calling fn on every item
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        best = min(best, time.perf_counter() - start)
+    return best / max(len(items), 1)
+
+def clear_caches():
+    """
+    Empties the caches shared across documents (tokenized sentences, EEG
+    sentence segmentation)
+    """
+    tokenize.cache_clear()
+    lfs_eeg.clear_sentence_cache()
+
+def docs_per_second(fn, texts, make_doc, repeat=3):
+    """
+    Best-of-repeat documents per second of fn over texts, each run on
+    freshly built documents with cold caches
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        clear_caches()
+        docs = [make_doc(text) for text in texts]
+        start = time.perf_counter()
+        for doc in docs:
+            fn(doc)
+        best = min(best, time.perf_counter() - start)
+    return len(texts) / best if best else float('inf')
+
+def _suite_runner(lfs):
+    def run(doc):
+        for lf in lfs:
+            lf(doc)
+    return run
+
+def bench_suite(lfs, texts, make_doc, repeat=3):
+    """
+    Docs/sec of each LF alone and of the whole suite; LFs that fail (e.g.
+    a missing spaCy model) are reported with their error instead
+    """
+    per_lf = {}
+    working = []
+    for lf in lfs:
+        try:
+            per_lf[lf.__name__] = docs_per_second(lf, texts, make_doc, repeat)
+            working.append(lf)
+        except Exception as e:
+            per_lf[lf.__name__] = {'error': repr(e)}
+    suite = docs_per_second(_suite_runner(working), texts, make_doc, repeat)
+    return {'docs': len(texts), 'lfs': per_lf, 'suite_docs_per_second': suite}
+
+def bench_length_scaling(lfs, vocabulary, make_doc, lengths=(2, 8, 32, 128), n=200,
+                         term_density=0.3, repeat=3, seed=0):
+    """
+    Suite docs/sec on synthetic reports of each length (in sentences)
+    """
+    run = _suite_runner(lfs)
+    rows = []
+    for n_sentences in lengths:
+        generator = ReportGenerator(vocabulary, term_density, seed)
+        texts = [generator.report(n_sentences) for _ in range(n)]
+        rows.append({
+            'sentences': n_sentences,
+            'mean_chars': sum(map(len, texts)) / len(texts),
+            'docs_per_second': docs_per_second(run, texts, make_doc, repeat),
+        })
+    return rows
+
+def search_each(terms):
+    """
+    The pre-fusion check: re.search with every term, without short-circuit
+    """
+    def search(text):
+        return any([re.search(reg, text, re.IGNORECASE) for reg in terms])
+    return search
+
+def bench_impression_patterns(n=2000, repeat=5, seed=0):
+    """
+    Per-report time of each impression term list searched term by term
+    vs. as one fused regex; returns (name, looped, fused, agree) rows
+    """
+    texts = synthetic_impressions(n, seed=seed)
+    rows = []
+    for name in ['NORMAL', 'ABNORMAL', 'EXTREME']:
+        terms = getattr(lfs_eeg, f'{name}_IMPRESSION_TERMS')
+        fused = getattr(lfs_eeg, f'{name}_IMPRESSION_RE').search
+        looped = search_each(terms)
+        agree = all(bool(fused(text)) == looped(text) for text in texts)
+        rows.append((name, time_per_item(looped, texts, repeat),
+                     time_per_item(fused, texts, repeat), agree))
+    return rows
+
+######################################################################################################
+##### RUNNER
+######################################################################################################
+
+def git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR,
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        return out.stdout.decode().strip() or None
+    except OSError:
+        return None
+
+def run_benchmarks(suites=SUITES, n_docs=500, term_density=0.3, lengths=(2, 8, 32, 128),
+                   repeat=3, csv_path=DEFAULT_CSV, seed=0):
+    """
+    Runs every benchmark and returns the results as a JSON-serializable dict
+    """
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'n_docs': n_docs, 'term_density': term_density, 'lengths': list(lengths),
+                   'repeat': repeat, 'seed': seed, 'eeg_segmenter': lfs_eeg.SENTENCE_SEGMENTER},
+        'suites': {},
+    }
+    csv_texts = load_csv_texts(csv_path, n_docs) if os.path.exists(csv_path) else None
+    for name in suites:
+        lfs, vocabulary, make_doc = load_suite(name)
+        synthetic = ReportGenerator(vocabulary, term_density, seed).reports(n_docs)
+        suite = {'synthetic': bench_suite(lfs, synthetic, make_doc, repeat)}
+        if csv_texts and name in CSV_SUITES:
+            suite['csv'] = bench_suite(lfs, csv_texts, make_doc, repeat)
+        working = [lf for lf in lfs if not isinstance(suite['synthetic']['lfs'][lf.__name__], dict)]
+        suite['length_scaling'] = bench_length_scaling(working, vocabulary, make_doc, lengths,
+                                                       min(n_docs, 200), term_density, repeat, seed)
+        results['suites'][name] = suite
+    results['eeg_impression_patterns'] = [
+        {'terms': name, 'looped_seconds': looped, 'fused_seconds': fused, 'same_votes': agree}
+        for name, looped, fused, agree in bench_impression_patterns(repeat=repeat, seed=seed)
+    ]
+    return results
+
+def format_results(results):
+    lines = [f'commit {results["commit"]}  python {results["python"]}']
+    for name, suite in results['suites'].items():
+        for corpus in ('synthetic', 'csv'):
+            if corpus not in suite:
+                continue
+            bench = suite[corpus]
+            lines.append(f'{name} / {corpus}: {bench["suite_docs_per_second"]:.0f} docs/s '
+                         f'for the suite over {bench["docs"]} docs')
+            for lf_name, rate in bench['lfs'].items():
+                value = rate['error'][:60] if isinstance(rate, dict) else f'{rate:12.0f} docs/s'
+                lines.append(f'    {lf_name:<45}{value}')
+        scaling = ', '.join(f'{row["sentences"]}: {row["docs_per_second"]:.0f}'
+                            for row in suite['length_scaling'])
+        lines.append(f'{name} / docs/s by sentences per report: {scaling}')
+    for row in results['eeg_impression_patterns']:
+        lines.append(f'eeg impression {row["terms"]:<9} looped {row["looped_seconds"] * 1e6:.2f}us '
+                     f'fused {row["fused_seconds"] * 1e6:.2f}us same votes {row["same_votes"]}')
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='LF throughput benchmarks')
+    parser.add_argument('--suites', nargs='+', default=SUITES, choices=SUITES)
+    parser.add_argument('--n-docs', type=int, default=500)
+    parser.add_argument('--term-density', type=float, default=0.3)
+    parser.add_argument('--lengths', type=int, nargs='+', default=[2, 8, 32, 128])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--csv', default=DEFAULT_CSV)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--eeg-segmenter', default=lfs_eeg.SENTENCE_SEGMENTER,
+                        choices=['parser', 'sentencizer'])
+    parser.add_argument('--out', help='write the results as JSON to this path')
+    args = parser.parse_args()
+
+    lfs_eeg.SENTENCE_SEGMENTER = args.eeg_segmenter
+    results = run_benchmarks(args.suites, args.n_docs, args.term_density, args.lengths,
+                             args.repeat, args.csv, args.seed)
+    print(format_results(results))
+    if args.out:
+        with open(args.out, 'w') as fout:
+            json.dump(results, fout, indent=1)
@@ -0,0 +1,155 @@
+import re
+
+import numpy as np
+
+######################################################################################################
+##### COLUMNAR LFs
+######################################################################################################
+
+def columnar_form(lf):
+    """
+    Decorator registering a vectorized form of the scalar LF lf:
+
+        @columnar_form(LF_a)
+        def a_columnar(reports):
+            ...
+
+    The columnar form takes a pd.Series of report texts and returns one
+    int8 vote per report, identical to calling lf on each; apply_lfs uses
+    it instead of the per-report loop. lf itself is unchanged.
+    """
+    def decorator(fn):
+        lf.columnar = fn
+        return fn
+    return decorator
+
+def votes_where(mask, vote, abstain=0):
+    """
+    int8 vote array: vote where mask is set, abstain elsewhere
+    """
+    return np.where(np.asarray(mask, dtype=bool), vote, abstain).astype(np.int8)
+
+######################################################################################################
+##### STRING KERNELS
+######################################################################################################
+
+# Joins the reports of a column; no LF pattern may match it
+SEPARATOR = '\x00'
+
+# Case-insensitive patterns made of ASCII words, spaces and alternations,
+# which match ASCII text exactly when it and they are lowercased
+PLAIN_PATTERN = re.compile(r'[\w |]*\Z', re.ASCII)
+
+# Where lowercasing and re.IGNORECASE can disagree
+NON_ASCII = re.compile('[^\x00-\x7f]')
+
+class Corpus(object):
+    """
+    The reports of a column joined into one string, so a pattern is
+    searched with one C-level scan instead of one call per report, plus
+    the offset at which each report starts
+    """
+
+    __slots__ = ('text', 'starts', '_non_ascii')
+
+    def __init__(self, texts):
+        self._non_ascii = None
+        self.text = SEPARATOR.join(texts)
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        self.starts = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum(lengths + 1, out=self.starts[1:])
+
+    def lower(self):
+        lowered = Corpus.__new__(Corpus)
+        lowered.text = self.text.lower()
+        lowered.starts = self.starts
+        lowered._non_ascii = self._non_ascii
+        if len(lowered.text) != len(self.text):
+            # A character lowercased to several, shifting the offsets
+            texts = [self.text[start:end - 1].lower()
+                     for start, end in zip(self.starts[:-1].tolist(), self.starts[1:].tolist())]
+            lowered = Corpus(texts)
+        return lowered
+
+    def lengths(self):
+        return np.diff(self.starts) - 1
+
+    def non_ascii(self):
+        """
+        Boolean array of the reports with a non-ASCII character
+        """
+        if self._non_ascii is None:
+            self._non_ascii = self.contains(NON_ASCII)
+        return self._non_ascii
+
+    def contains(self, pattern):
+        """
+        Boolean array of the reports containing pattern, a substring or a
+        compiled regex that cannot match SEPARATOR and has no ^ or $
+        anchors
+        """
+        hits = np.zeros(len(self.starts) - 1, dtype=bool)
+        if isinstance(pattern, str):
+            search = lambda pos: self.text.find(pattern, pos)
+        else:
+            def search(pos):
+                match = pattern.search(self.text, pos)
+                return -1 if match is None else match.start()
+        starts = self.starts
+        pos = search(0)
+        while pos >= 0:
+            idx = int(np.searchsorted(starts, pos, side='right')) - 1
+            hits[idx] = True
+            # One hit per report is enough
+            pos = search(int(starts[idx + 1]))
+        return hits
+
+# Identity memo: the LFs of one column share its corpus until release_corpus
+_last_corpus = (None, None, None)
+
+def report_corpus(reports, lower=False):
+    """
+    Corpus of the pd.Series reports (lowercased if lower), built once per
+    Series and case
+    """
+    global _last_corpus
+    series, corpus, lowered = _last_corpus
+    if series is not reports:
+        corpus, lowered = Corpus(reports.tolist()), None
+    if lower and lowered is None:
+        lowered = corpus.lower()
+    _last_corpus = (reports, corpus, lowered)
+    return lowered if lower else corpus
+
+def release_corpus():
+    """
+    Drops the memoized corpus, so it does not outlive the reports it was
+    built for
+    """
+    global _last_corpus
+    _last_corpus = (None, None, None)
+
+def lengths(reports):
+    """
+    Vectorized reports.str.len()
+    """
+    return report_corpus(reports).lengths()
+
+def contains(reports, pattern, lower=False):
+    """
+    Vectorized reports.str.contains(pattern) (on the lowercased reports
+    if lower) over a report corpus; see Corpus.contains.
+
+    A plain (see PLAIN_PATTERN) regex compiled with re.IGNORECASE is
+    searched case-sensitively in the lowercased corpus, several times
+    faster, and again in each non-ASCII report, where lowercasing is not
+    equivalent.
+    """
+    if lower or isinstance(pattern, str) or not pattern.flags & re.IGNORECASE \
+            or not PLAIN_PATTERN.match(pattern.pattern):
+        return report_corpus(reports, lower).contains(pattern)
+    hits = report_corpus(reports, lower=True).contains(re.compile(pattern.pattern.lower()))
+    irregular = report_corpus(reports).non_ascii()
+    if irregular.any():
+        hits[irregular] = [pattern.search(report) is not None for report in reports[irregular]]
+    return hits
@@ -0,0 +1,110 @@
+import sys
+from functools import update_wrapper
+from time import perf_counter
+
+######################################################################################################
+##### COMPOSITE LFs
+######################################################################################################
+
+class CompositeLF(object):
+    """
+    An LF whose vote is computed from the votes of other LFs (its deps).
+
+    Called on a report like any LF, it evaluates its deps and passes their
+    votes to combine. Inside an LFPlan, each dep is evaluated once per
+    report and its vote shared with every composite that depends on it.
+    """
+
+    def __init__(self, combine, deps):
+        self.combine = combine
+        self.deps = tuple(deps)
+        update_wrapper(self, combine)
+
+    def __call__(self, report):
+        return self.combine(*[dep(report) for dep in self.deps])
+
+    def __repr__(self):
+        return f'CompositeLF({self.__name__})'
+
+    def __reduce__(self):
+        # A composite bound to its module-level name, as composite_lf leaves
+        # it, pickles by that name like a function; update_wrapper gave it
+        # combine's __module__ and __qualname__
+        if getattr(sys.modules.get(self.__module__), self.__qualname__, None) is self:
+            return self.__qualname__
+        return (CompositeLF, (self.combine, self.deps))
+
+def composite_lf(*deps):
+    """
+    Decorator declaring a function of deps' votes as a composite LF:
+
+        @composite_lf(LF_a, LF_b)
+        def LF_a_or_b(a, b):
+            ...
+    """
+    def decorator(combine):
+        return CompositeLF(combine, deps)
+    return decorator
+
+class LFPlan(object):
+    """
+    Evaluation order for a list of LFs and, transitively, the deps of its
+    composites: every LF is evaluated exactly once per report, after its
+    deps, and evaluate returns the votes of the requested LFs in order
+    """
+
+    def __init__(self, lfs):
+        self.lfs = []
+        self._slots = {}
+        self._steps = []
+        for lf in lfs:
+            self._visit(lf, set())
+        self.outputs = [self._slots[lf] for lf in lfs]
+
+    def _visit(self, lf, path):
+        if lf in self._slots:
+            return self._slots[lf]
+        if lf in path:
+            raise ValueError(f'Cyclic LF dependency through {lf.__name__}')
+        if isinstance(lf, CompositeLF):
+            path.add(lf)
+            dep_slots = tuple(self._visit(dep, path) for dep in lf.deps)
+            path.discard(lf)
+            step = (lf.combine, dep_slots)
+        else:
+            step = (lf, None)
+        self._slots[lf] = len(self.lfs)
+        self.lfs.append(lf)
+        self._steps.append(step)
+        return self._slots[lf]
+
+    def evaluate(self, report):
+        """
+        Votes of the requested LFs on report
+        """
+        votes = []
+        for fn, dep_slots in self._steps:
+            if dep_slots is None:
+                votes.append(fn(report))
+            else:
+                votes.append(fn(*[votes[slot] for slot in dep_slots]))
+        return [votes[slot] for slot in self.outputs]
+
+    def evaluate_timed(self, report, record):
+        """
+        evaluate, also calling record(index in self.lfs, seconds, vote)
+        for every LF evaluated
+        """
+        votes = []
+        for slot, (fn, dep_slots) in enumerate(self._steps):
+            start = perf_counter()
+            if dep_slots is None:
+                vote = fn(report)
+            else:
+                vote = fn(*[votes[dep] for dep in dep_slots])
+            record(slot, perf_counter() - start, vote)
+            votes.append(vote)
+        return [votes[slot] for slot in self.outputs]
+
+def has_composites(lfs):
+    return any(isinstance(lf, CompositeLF) for lf in lfs)
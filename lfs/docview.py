@@ -0,0 +1,156 @@
+class DocView(str):
+    """
+    A single report shared by every LF applied to it.
+
+    A DocView is the report string itself (a str subclass, so re, slicing
+    and every str method work on it unchanged), carrying caches: the
+    lowercased text, the sentence boundaries (the report split on periods,
+    kept as offsets) and section slices are computed at most once, so a
+    suite of LFs only pays for this preprocessing once per report. Other
+    per-report results (e.g. keyword hits) can be memoized in memo. It
+    also stands in for a candidate object (c.report_text.text).
+    """
+
+    def __new__(cls, text):
+        self = str.__new__(cls, text)
+        # The plain str, for code that needs exactly a str
+        self.text = str(text)
+        self._lower = None
+        self._spans = None
+        self._sentences = None
+        self._sections = None
+        self._memo = None
+        return self
+
+    def __reduce__(self):
+        # Only the text: the caches are rebuilt on demand, and the memo can
+        # hold unpicklable keys (e.g. KeywordMatcher scanners)
+        return (DocView, (self.text,))
+
+    @property
+    def report_text(self):
+        return self
+
+    @property
+    def memo(self):
+        """
+        Dict for caching other derived per-report results
+        """
+        if self._memo is None:
+            self._memo = {}
+        return self._memo
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return f'DocView({self.text[:40]!r})'
+
+    def lower(self):
+        """
+        Lowercased report text
+        """
+        if self._lower is None:
+            self._lower = self.text.lower()
+        return self._lower
+
+    def split(self, sep=None, maxsplit=-1):
+        """
+        Same as str.split; splitting on periods copies the cached sentences
+        """
+        if sep == '.' and maxsplit == -1:
+            return list(self.sentences)
+        return self.text.split(sep, maxsplit)
+
+    @property
+    def sentence_spans(self):
+        """
+        (start, end) offsets of each period-delimited sentence
+        """
+        if self._spans is None:
+            text = self.text
+            spans = []
+            start = 0
+            end = text.find('.')
+            while end != -1:
+                spans.append((start, end))
+                start = end + 1
+                end = text.find('.', start)
+            spans.append((start, len(text)))
+            self._spans = tuple(spans)
+        return self._spans
+
+    @property
+    def sentences(self):
+        """
+        Sentences of the report, as a tuple of what text.split('.') returns,
+        so the cached sentences cannot be modified
+        """
+        if self._sentences is None:
+            text = self.text
+            self._sentences = tuple(text[start:end] for start, end in self.sentence_spans)
+        return self._sentences
+
+    def section_span(self, start=None, end=None):
+        """
+        Offsets of the text from marker start up to marker end, following
+        text[text.find(start):] and then [:find(end)], including their
+        behavior when a marker is missing
+        """
+        key = (start, end)
+        if self._sections is None:
+            self._sections = {}
+        span = self._sections.get(key)
+        if span is None:
+            text = self.text
+            lo = 0
+            if start is not None:
+                lo = text.find(start)
+                if lo == -1:
+                    lo = max(len(text) - 1, 0)
+            hi = len(text)
+            if end is not None:
+                hi = text.find(end, lo)
+                if hi == -1:
+                    hi = max(len(text) - 1, lo)
+            span = (lo, hi)
+            self._sections[key] = span
+        return span
+
+    def section(self, start=None, end=None):
+        """
+        Text of the section between markers start and end
+        """
+        lo, hi = self.section_span(start, end)
+        return self.text[lo:hi]
+
+    def section_lower(self, start=None, end=None):
+        """
+        Lowercased text of the section between markers start and end
+        """
+        lo, hi = self.section_span(start, end)
+        lower = self.lower()
+        if len(lower) == len(self.text):
+            return lower[lo:hi]
+        return self.text[lo:hi].lower()
+
+def report_memo(report):
+    """
+    Dict for caching derived per-report results: a DocView's memo, or for
+    another document object (e.g. an EEGNote) a dict stored on it
+    """
+    if isinstance(report, DocView):
+        return report.memo
+    # setdefault: threads sharing a report share one memo
+    return vars(report).setdefault('_report_memo', {})
+
+def as_doc(report):
+    """
+    Returns a DocView for a DocView, a raw report string or a candidate
+    with report_text.text
+    """
+    if isinstance(report, DocView):
+        return report
+    if isinstance(report, str):
+        return DocView(report)
+    return DocView(report.report_text.text)
@@ -0,0 +1,129 @@
+from docview import as_doc
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+class KeywordGroup(int):
+    """
+    The bit of one keyword list registered with a KeywordMatcher. It is an
+    int, so hits(report) & group works as with any bit, and it carries its
+    keywords, so an LF's fingerprint can depend on its own list alone.
+    """
+
+    def __new__(cls, bit, keywords):
+        self = int.__new__(cls, bit)
+        self.keywords = tuple(keywords)
+        return self
+
+    def __getnewargs__(self):
+        return (int(self), self.keywords)
+
+    def __repr__(self):
+        return f'KeywordGroup({int(self)}, {list(self.keywords)})'
+
+class KeywordMatcher(object):
+    """
+    Finds which of several keyword lists occur in a report, computing the
+    hits of every list together once per report.
+
+    Each keyword list (usually one per LF) is registered with add, which
+    returns the bit for that list. scan returns the bitwise OR of the bits
+    of every list with at least one keyword occurring as a substring, so
+    `hits(report) & bit` is equivalent to
+    `any(word in text for word in keywords)`.
+
+    With pyahocorasick installed, all keyword lists are compiled into one
+    Aho-Corasick automaton and each report is scanned exactly once.
+    Without it, each distinct keyword is tested with str's C substring
+    search, skipping keywords whose lists have already hit; for a handful
+    of short keywords this beats any automaton walked from Python. Either
+    way the mask is computed once per report and shared by all its LFs.
+    """
+
+    def __init__(self, lower=False):
+        # Whether keywords are matched against the lowercased report
+        self.lower = lower
+        self._masks = {}
+        self._always = 0
+        self._n_groups = 0
+        self._full = 0
+        self._scanner = None
+
+    def __repr__(self):
+        # The keyword lists are described by the KeywordGroups add returns
+        return f'KeywordMatcher(lower={self.lower})'
+
+    def add(self, keywords):
+        """
+        Registers a keyword list and returns its bit, as a KeywordGroup
+        """
+        bit = 1 << self._n_groups
+        self._n_groups += 1
+        self._full |= bit
+        for word in keywords:
+            if word:
+                self._masks[word] = self._masks.get(word, 0) | bit
+            else:
+                self._always |= bit
+        self._scanner = None
+        return KeywordGroup(bit, keywords)
+
+    def _build(self):
+        if ahocorasick is not None:
+            automaton = ahocorasick.Automaton()
+            for word, mask in self._masks.items():
+                automaton.add_word(word, mask)
+            if len(automaton):
+                automaton.make_automaton()
+                return self._automaton_scanner(automaton)
+        return self._substring_scanner(list(self._masks.items()))
+
+    def _automaton_scanner(self, automaton):
+        always, full = self._always, self._full
+
+        def scan(text):
+            mask = always
+            if mask == full:
+                return mask
+            for _, word_mask in automaton.iter(text):
+                mask |= word_mask
+                if mask == full:
+                    break
+            return mask
+        return scan
+
+    def _substring_scanner(self, items):
+        always, full = self._always, self._full
+
+        def scan(text):
+            mask = always
+            for word, word_mask in items:
+                if mask & word_mask != word_mask and word in text:
+                    mask |= word_mask
+                    if mask == full:
+                        break
+            return mask
+        return scan
+
+    def scan(self, text):
+        """
+        Returns the bitmask of keyword lists occurring in text
+        """
+        if self._scanner is None:
+            self._scanner = self._build()
+        return self._scanner(text)
+
+    def hits(self, report):
+        """
+        Returns the bitmask of keyword lists occurring in a report (string,
+        candidate or DocView), memoized on the report's DocView
+        """
+        doc = as_doc(report)
+        memo = doc.memo
+        mask = memo.get(self)
+        if mask is None:
+            mask = self.scan(doc.lower() if self.lower else doc.text)
+            memo[self] = mask
+        return mask
@@ -1,5 +1,10 @@
 import re
 
+from docview import as_doc
+from keyword_matcher import KeywordMatcher
+from negation import NegationWindow
+from patterns import EQUIVOCATION, compile_pattern
+
 # Setting LF output values
 ABSTAIN_VAL = 0
 ABNORMAL_VAL = 1
@@ -10,9 +15,9 @@ NORMAL_VAL = -1
 ######################################################################################################
 
 # Equivocation terms
-equiv_str = 'unlikely|likely|suggests|questionable|concerning|possibly|potentially|could represent|may represent|may relate|cannot exclude|can\'t exclude|may be'
+equiv_str = EQUIVOCATION
 equiv_lst = equiv_str.split('|')
-reg_equivocation = re.compile(equiv_str,re.IGNORECASE)
+reg_equivocation = compile_pattern(equiv_str,re.IGNORECASE)
 
 # Terms indicating followup required
 followup_terms = ["followup","referred", "paged", "contacted","contact"]
@@ -46,6 +51,38 @@ categories = ['normal','opacity','cardiomegaly','calcinosis',
 # Words with negative inflection
 negative_inflection_words = ["but", "however", "otherwise",equiv_str]
 
+# Keyword lists of the substring LFs, matched in one pass over the report
+report_keywords = KeywordMatcher()
+kw_equivocation = report_keywords.add(equiv_lst)
+kw_negative_inflection = report_keywords.add(negative_inflection_words)
+kw_seen_or_noted = report_keywords.add(["seen", "noted","observed"])
+kw_disease = report_keywords.add(["disease"])
+kw_recommend = report_keywords.add(["recommend"])
+kw_measured = report_keywords.add(["mm", "cm","millimeter","centimeter"])
+kw_abnormal_disease_terms = report_keywords.add(abnormal_disease_terms)
+
+# Standard normal phrases
+reg_gross = compile_pattern('gross',re.IGNORECASE)
+reg_no_acute = compile_pattern('No acute cardiopulmonary abnormality',re.IGNORECASE)
+reg_normal_xray = compile_pattern('normal chest X-ray',re.IGNORECASE)
+
+# Positive and negated mentions of each disease category
+reg_categories_pos = [compile_pattern(cat,re.IGNORECASE) for cat in categories]
+neg_categories = [NegationWindow(cat) for cat in categories]
+
+# Regexes for specific findings
+reg_fracture = compile_pattern('fracture',re.IGNORECASE)
+neg_fracture = NegationWindow('fracture')
+reg_calc = compile_pattern('calc',re.IGNORECASE)
+reg_calc_site = compile_pattern('arter|aorta|muscle|tissue',re.IGNORECASE)
+reg_degen = compile_pattern('degen',re.IGNORECASE)
+reg_spine = compile_pattern('spine',re.IGNORECASE)
+reg_hypoinflation = compile_pattern('hypoinflation|collapse|(low|decrease|diminish)\\s([a-zA-Z0-9\-,_]*\\s){0,4}volume',re.IGNORECASE)
+reg_hyperdistention = compile_pattern('increased volume|hyperexpan|inflated',re.IGNORECASE)
+reg_catheters = compile_pattern(' line|catheter|PICC',re.IGNORECASE)
+reg_clip = compile_pattern('clip',re.IGNORECASE)
+reg_granuloma = compile_pattern('granuloma',re.IGNORECASE)
+
 ######################################################################################################
 ##### LABELING FUNCTIONS (LFs)
 ######################################################################################################
@@ -56,7 +93,7 @@ def LF_report_length(c):
     """
     short_cutoff = 425
     long_cutoff = 700
-    ln = len(c.report_text.text)
+    ln = len(as_doc(c).text)
     if ln<short_cutoff:
         return NORMAL_VAL
     elif ln>long_cutoff:
@@ -68,47 +105,43 @@ def LF_equivocation(c):
     """
     Checking for equivocation
     """
-    return ABNORMAL_VAL if any(word in c.report_text.text \
-                      for word in equiv_lst) else ABSTAIN_VAL
+    return ABNORMAL_VAL if report_keywords.hits(c) & kw_equivocation else ABSTAIN_VAL
 
 def LF_negative_inflection_words_in_report(c):
     """
     Checking for negative inflection words
     """
-    return ABNORMAL_VAL if any(word in c.report_text.text \
-                      for word in negative_inflection_words) else ABSTAIN_VAL
+    return ABNORMAL_VAL if report_keywords.hits(c) & kw_negative_inflection else ABSTAIN_VAL
 
 def LF_is_seen_or_noted_in_report(c):
     """
     Checking for indications of a phenomenology
     """
-    return ABNORMAL_VAL if any(word in c.report_text.text \
-                      for word in ["seen", "noted","observed"]) else ABSTAIN_VAL
+    return ABNORMAL_VAL if report_keywords.hits(c) & kw_seen_or_noted else ABSTAIN_VAL
 
 def LF_disease_in_report(c):
     """
     Checking for mentions of disease
     """
-    return ABNORMAL_VAL if "disease" in c.report_text.text else ABSTAIN_VAL
+    return ABNORMAL_VAL if report_keywords.hits(c) & kw_disease else ABSTAIN_VAL
 
 def LF_recommend_in_report(c):
     """
     Checking for recommended followup
     """
-    return ABNORMAL_VAL if "recommend" in c.report_text.text else ABSTAIN_VAL
+    return ABNORMAL_VAL if report_keywords.hits(c) & kw_recommend else ABSTAIN_VAL
 
 def LF_mm_in_report(c):
     """
     Checking for anything that was measured
     """
-    return ABNORMAL_VAL if any(word in c.report_text.text \
-                      for word in ["mm", "cm","millimeter","centimeter"]) else ABSTAIN_VAL
+    return ABNORMAL_VAL if report_keywords.hits(c) & kw_measured else ABSTAIN_VAL
     
 def LF_abnormal_disease_terms_in_report(c):
     """
     Checking for abnormal disease terms
     """
-    if any(mesh in c.report_text.text for mesh in abnormal_disease_terms):
+    if report_keywords.hits(c) & kw_abnormal_disease_terms:
         return ABNORMAL_VAL
     else:
         return ABSTAIN_VAL    
@@ -118,14 +151,11 @@ def LF_consistency_in_report(c):
     Checking for the words 'clear', 'no', 'normal', 'free', 'midline' in
     findings section of the report
     """
-    report = c.report_text.text
-    findings = report[report.find('FINDINGS:'):]
-    findings = findings[:findings.find('IMPRESSION:')]
+    findings = as_doc(c).section_lower('FINDINGS:', 'IMPRESSION:')
     sents = findings.split('.')
 
     num_sents_without_normal = 0
     for sent in sents:
-        sent = sent.lower()
         if not any(word in sent for word in words_indicating_normalcy):
             num_sents_without_normal += 1
         elif 'not' in sent:
@@ -144,9 +174,8 @@ def LF_gross(report):
     """
     Checking for word "gross"
     """
-    reg_pos = re.compile('gross',re.IGNORECASE)
-    for s in report.report_text.text.split("."):
-        if reg_pos.search(s):
+    for s in as_doc(report).sentences:
+        if reg_gross.search(s):
             return ABNORMAL_VAL
     return ABSTAIN_VAL
 
@@ -154,10 +183,8 @@ def LF_normal(report):
     """
     Checking for various standard indications of normality
     """
-    r = re.compile('No acute cardiopulmonary abnormality',re.IGNORECASE)
-    r2 = re.compile('normal chest X-ray',re.IGNORECASE)
-    for s in report.report_text.text.split("."):
-        if r.search(s) or r2.search(s): # or r3.search(s) or r4.search(s):
+    for s in as_doc(report).sentences:
+        if reg_no_acute.search(s) or reg_normal_xray.search(s): # or r3.search(s) or r4.search(s):
             return NORMAL_VAL
     return ABSTAIN_VAL
 
@@ -166,10 +193,10 @@ def LF_positive_MeshTerm(report):
     Looking for positive mesh terms
     """
     for idx in range(1,len(categories)):
-        reg_pos = re.compile(categories[idx],re.IGNORECASE)
-        reg_neg = re.compile('(No|without|resolution)\\s([a-zA-Z0-9\-,_]*\\s){0,10}'+categories[idx],re.IGNORECASE)
-        for s in report.report_text.text.split("."):
-            if reg_pos.search(s) and (not reg_neg.search(s)) and (not reg_equivocation.search(s)):
+        reg_pos = reg_categories_pos[idx]
+        neg = neg_categories[idx]
+        for s in as_doc(report).sentences:
+            if reg_pos.search(s) and (not neg.search(s)) and (not reg_equivocation.search(s)):
                 return ABNORMAL_VAL
     return ABSTAIN_VAL
 
@@ -177,10 +204,8 @@ def LF_fracture(report):
     """
     Looking for evidence of fracture
     """
-    reg_pos = re.compile('fracture',re.IGNORECASE)
-    reg_neg = re.compile('(No|without|resolution)\\s([a-zA-Z0-9\-,_]*\\s){0,10}fracture',re.IGNORECASE)
-    for s in report.report_text.text.split("."):
-        if reg_pos.search(s) and (not reg_neg.search(s)) and (not reg_equivocation.search(s)):
+    for s in as_doc(report).sentences:
+        if reg_fracture.search(s) and (not neg_fracture.search(s)) and (not reg_equivocation.search(s)):
             return ABNORMAL_VAL
     return ABSTAIN_VAL
 
@@ -188,10 +213,8 @@ def LF_calcinosis(report):
     """
     Looking for evidence of calcinosis
     """
-    reg_01 = re.compile('calc',re.IGNORECASE)
-    reg_02 = re.compile('arter|aorta|muscle|tissue',re.IGNORECASE)
-    for s in report.report_text.text.split("."):
-        if reg_01.search(s) and reg_02.search(s):
+    for s in as_doc(report).sentences:
+        if reg_calc.search(s) and reg_calc_site.search(s):
             return ABNORMAL_VAL
     return ABSTAIN_VAL
 
@@ -199,10 +222,8 @@ def LF_degen_spine(report):
     """
     Looking for degenerative spinal disease
     """
-    reg_01 = re.compile('degen',re.IGNORECASE)
-    reg_02 = re.compile('spine',re.IGNORECASE)
-    for s in report.report_text.text.split("."):
-        if reg_01.search(s) and reg_02.search(s):
+    for s in as_doc(report).sentences:
+        if reg_degen.search(s) and reg_spine.search(s):
             return ABNORMAL_VAL
     return ABSTAIN_VAL
 
@@ -211,9 +232,8 @@ def LF_lung_hypoinflation(report):
     Looking for lung hypoinflation
     """
     #reg_01 = re.compile('lung|pulmonary',re.IGNORECASE)
-    reg_01 = re.compile('hypoinflation|collapse|(low|decrease|diminish)\\s([a-zA-Z0-9\-,_]*\\s){0,4}volume',re.IGNORECASE)
-    for s in report.report_text.text.split("."):
-        if reg_01.search(s):
+    for s in as_doc(report).sentences:
+        if reg_hypoinflation.search(s):
             return ABNORMAL_VAL
     return ABSTAIN_VAL
 
@@ -222,9 +242,8 @@ def LF_lung_hyperdistention(report):
     Looking for lung hyperdistention
     """
     #reg_01 = re.compile('lung|pulmonary',re.IGNORECASE)
-    reg_01 = re.compile('increased volume|hyperexpan|inflated',re.IGNORECASE)
-    for s in report.report_text.text.split("."):
-        if reg_01.search(s):
+    for s in as_doc(report).sentences:
+        if reg_hyperdistention.search(s):
             return ABNORMAL_VAL
     return ABSTAIN_VAL
 
@@ -232,9 +251,8 @@ def LF_catheters(report):
     """
     Looking for mentions of catheters
     """
-    reg_01 = re.compile(' line|catheter|PICC',re.IGNORECASE)
-    for s in report.report_text.text.split("."):
-        if reg_01.search(s):
+    for s in as_doc(report).sentences:
+        if reg_catheters.search(s):
             return ABNORMAL_VAL
     return ABSTAIN_VAL
 
@@ -242,9 +260,8 @@ def LF_surgical(report):
     """
     Looking for mentions of surgical hardware
     """
-    reg_01 = re.compile('clip',re.IGNORECASE)
-    for s in report.report_text.text.split("."):
-        if reg_01.search(s):
+    for s in as_doc(report).sentences:
+        if reg_clip.search(s):
             return ABNORMAL_VAL
     return ABSTAIN_VAL
 
@@ -252,8 +269,7 @@ def LF_granuloma(report):
     """
     Looking for instances of granuloma
     """
-    reg_01 = re.compile('granuloma',re.IGNORECASE)
-    for s in report.report_text.text.split("."):
-        if reg_01.search(s):
+    for s in as_doc(report).sentences:
+        if reg_granuloma.search(s):
             return ABNORMAL_VAL
     return ABSTAIN_VAL
\ No newline at end of file
@@ -1,24 +1,153 @@
+import hashlib
 import re
-import spacy
-spacy_en = spacy.load('en_core_web_sm')
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from docview import report_memo
+from patterns import compile_pattern
 
 # Setting LF output values
 ABSTAIN_VAL = 0
 SEIZURE_VAL = 1
 NO_SEIZURE_VAL = -1
 
+######################################################################################################
+##### SENTENCE SEGMENTATION
+######################################################################################################
+
+SPACY_MODEL = 'en_core_web_sm'
+
+# Sentence segmenter used by the negex LFs: 'parser' (boundaries from the
+# dependency parse of SPACY_MODEL) or 'sentencizer' (spaCy's rule-based
+# punctuation splitter, no model needed; boundaries can differ)
+SENTENCE_SEGMENTER = 'parser'
+
+# Pipeline components of SPACY_MODEL that sentence boundaries do not need
+UNUSED_COMPONENTS = ['tagger', 'ner', 'lemmatizer', 'attribute_ruler', 'textcat']
+
+_spacy_pipelines = {}
+
+def get_spacy_en(segmenter=None):
+    """
+    Returns the spaCy pipeline for segmenter (default SENTENCE_SEGMENTER),
+    loading it on first use with only what sentence segmentation needs
+    """
+    segmenter = segmenter or SENTENCE_SEGMENTER
+    nlp = _spacy_pipelines.get(segmenter)
+    if nlp is None:
+        # Imported here: importing spaCy alone takes seconds
+        import spacy
+        if segmenter == 'parser':
+            nlp = spacy.load(SPACY_MODEL, disable=UNUSED_COMPONENTS)
+        elif segmenter == 'sentencizer':
+            nlp = spacy.blank('en')
+            if spacy.__version__.startswith('2.'):
+                nlp.add_pipe(nlp.create_pipe('sentencizer'))
+            else:
+                nlp.add_pipe('sentencizer')
+        else:
+            raise ValueError(f'Unknown sentence segmenter: {segmenter}')
+        _spacy_pipelines[segmenter] = nlp
+    return nlp
+
+# Texts whose sentence spans are kept; well above the documents handed
+# to a batch of LFs at once, so a prefetched batch stays cached
+SENTENCE_CACHE_SIZE = 4096
+
+# Sentence spans per (segmenter, text digest), least recently used first,
+# filled by segment_sentences and prefetch_sentences
+_sentence_spans = OrderedDict()
+
+def _text_key(text, segmenter):
+    return (segmenter, hashlib.sha1(text.encode('utf-8')).digest())
+
+def clear_sentence_cache():
+    _sentence_spans.clear()
+
+def _cache_spans(key, spans):
+    _sentence_spans[key] = spans
+    while len(_sentence_spans) > SENTENCE_CACHE_SIZE:
+        try:
+            _sentence_spans.popitem(last=False)
+        except KeyError:
+            # Emptied by another thread
+            break
+
+def segment_sentences(text, segmenter=None):
+    """
+    Sentences of text as split by segmenter, cached by text content
+    """
+    segmenter = segmenter or SENTENCE_SEGMENTER
+    key = _text_key(text, segmenter)
+    spans = _sentence_spans.get(key)
+    if spans is None:
+        doc = get_spacy_en(segmenter)(text)
+        spans = [(sent.start_char, sent.end_char) for sent in doc.sents]
+        _cache_spans(key, spans)
+    else:
+        try:
+            _sentence_spans.move_to_end(key)
+        except KeyError:
+            # Evicted by another thread meanwhile
+            pass
+    return [text[start:end] for start, end in spans]
+
+def prefetch_sentences(texts, segmenter=None, batch_size=64, n_process=1):
+    """
+    Segments every distinct uncached text in one batched nlp.pipe run
+    (over n_process processes if n_process > 1) and caches the sentence
+    spans for segment_sentences. Only the last SENTENCE_CACHE_SIZE texts
+    stay cached.
+    """
+    segmenter = segmenter or SENTENCE_SEGMENTER
+    todo = {}
+    for text in texts:
+        key = _text_key(text, segmenter)
+        if key not in _sentence_spans:
+            todo[key] = text
+    if not todo:
+        return
+    nlp = get_spacy_en(segmenter)
+    kwargs = {'n_process': n_process} if n_process != 1 else {}
+    docs = nlp.pipe(list(todo.values()), batch_size=batch_size, **kwargs)
+    for key, doc in zip(todo, docs):
+        _cache_spans(key, [(sent.start_char, sent.end_char) for sent in doc.sents])
+
+def time_segmenter(texts, segmenter=None):
+    """
+    Measures how long segmenter takes to load and to split texts into
+    sentences; returns a dict of timings and throughput
+    """
+    segmenter = segmenter or SENTENCE_SEGMENTER
+    _spacy_pipelines.pop(segmenter, None)
+    start = time.perf_counter()
+    nlp = get_spacy_en(segmenter)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    n_sentences = sum(len(list(nlp(text).sents)) for text in texts)
+    segment_seconds = time.perf_counter() - start
+    return {
+        'segmenter': segmenter,
+        'load_seconds': load_seconds,
+        'segment_seconds': segment_seconds,
+        'texts': len(texts),
+        'sentences': n_sentences,
+        'sentences_per_second': n_sentences / segment_seconds if segment_seconds else float('inf'),
+    }
+
 ######################################################################################################
 ##### HELPFUL REGEXES AND ONTOLOGIES
 ######################################################################################################
 
 # Defining useful regular expressions.
-SIMPLE_NORMAL_RE = re.compile('\snormal\s', re.IGNORECASE)
+SIMPLE_NORMAL_RE = compile_pattern('\snormal\s', re.IGNORECASE)
 
 # Nouns indicating an EEG
 EEGSYN = r'(EEG|study|record|electroencephalogram|ambulatory\s+EEG|video.EEG\sstudy)'
 
 # Phrases indicating a normal study
-NORMAL_STUDY_PHRASES = re.compile(rf'\snormal\s+{EEGSYN}'
+NORMAL_STUDY_PHRASES = compile_pattern(rf'\snormal\s+{EEGSYN}'
                                   rf'|\snormal\s+awake\s+and\s+asleep\s+{EEGSYN}'
                                   rf'|\snormal\s+awake\s+{EEGSYN}'
                                   rf'|\snormal\s+awake\s+and\s+drowsy\s+{EEGSYN}'
@@ -36,25 +165,25 @@ NORMAL_STUDY_PHRASES = re.compile(rf'\snormal\s+{EEGSYN}'
                                   re.IGNORECASE)
 
 # Regex for abnormal
-ABNORMAL_RE = re.compile(r'abnormal', re.IGNORECASE)
+ABNORMAL_RE = compile_pattern(r'abnormal', re.IGNORECASE)
 
 # Regex for seizure synonyms
 SEIZURE_SYNONYMS = r'seizure|seizures|spasm|spasms|status\sepilepticus|epilepsia\spartialis\scontinua|drop\sattack'
-SEIZURE_SYNONYMS_RE = re.compile(SEIZURE_SYNONYMS, re.IGNORECASE|re.UNICODE)
+SEIZURE_SYNONYMS_RE = compile_pattern(SEIZURE_SYNONYMS, re.IGNORECASE|re.UNICODE)
 
 # Regex for negation
 NEG_DET = ['no', 'not', 'without'] 
 
 # Regex for no seizure in study
 NEG_SEIZURE = r'no seizures|no epileptiform activity or seizures'.replace(' ','\s')  
-NEG_SEIZURE_RE = re.compile(NEG_SEIZURE, re.IGNORECASE)
+NEG_SEIZURE_RE = compile_pattern(NEG_SEIZURE, re.IGNORECASE)
 
 # Alternate section keys for INTERPRATION section of report 
 candidate_interps = ['INTERPRETATION', 'Interpretation', 'Summary', 'impression', 'IMPRESSION', 'conclusion', 'conclusions']
 CANDIDATE_INTERPS_LOWER = list({ss.lower() for ss in candidate_interps})
 
 # Alternate regex for no seizures 
-NOSEIZURE_PHRASE_RE = re.compile(r'\bno seizures\b|\bno\sepileptiform\sactivity\sor\sseizures\b'
+NOSEIZURE_PHRASE_RE = compile_pattern(r'\bno seizures\b|\bno\sepileptiform\sactivity\sor\sseizures\b'
                       r'|\bno findings to indicate seizures\b'
                       r'|no findings to indicate'
                       r'|no new seizures'
@@ -67,8 +196,36 @@ NOSEIZURE_PHRASE_RE = re.compile(r'\bno seizures\b|\bno\sepileptiform\sactivity\
 
 # Defining negexes
 NEG_DET= r'(\bno\b|\bnot\b|\bwithout\sfurther\b|\bno\sfurther\b|without|neither)'
-BASIC_NEGEX_RE = re.compile(NEG_DET + '.*('+ SEIZURE_SYNONYMS + ')', re.IGNORECASE|re.UNICODE)
-REVERSED_NEGEX_RE = re.compile('('+ SEIZURE_SYNONYMS + ').*' + NEG_DET, re.IGNORECASE|re.UNICODE)
+BASIC_NEGEX_RE = compile_pattern(NEG_DET + '.*('+ SEIZURE_SYNONYMS + ')', re.IGNORECASE|re.UNICODE)
+REVERSED_NEGEX_RE = compile_pattern('('+ SEIZURE_SYNONYMS + ').*' + NEG_DET, re.IGNORECASE|re.UNICODE)
+
+# Regex for spikes
+SPIKE_RE = compile_pattern('spike', re.IGNORECASE)
+
+def fuse_patterns(patterns, flags=re.IGNORECASE):
+    """
+    Compiles a list of patterns into one alternation that matches wherever
+    any of them does
+    """
+    return compile_pattern('|'.join(f'(?:{p})' for p in patterns), flags)
+
+# Sections holding the impression
+IMPRESSION_WORDS = ['impression','interpretation','comments']
+
+# Impression terms indicating no seizure
+NORMAL_IMPRESSION_TERMS = ['no epileptiform', 'absence of epileptiform', 'not epileptiform', 
+                           'normal EEG', 'normal aEEG','benign','non-specific','nonepileptic','idiopathic',
+                           'no seizures','EEG is normal','normal study']
+NORMAL_IMPRESSION_RE = fuse_patterns(NORMAL_IMPRESSION_TERMS)
+
+# Impression terms indicating a seizure
+ABNORMAL_IMPRESSION_TERMS = ['status epilepticus','spasms','abnormal continuous',
+                             'tonic','subclinical','spike-wave', 'markedly abnormal']
+ABNORMAL_IMPRESSION_RE = fuse_patterns(ABNORMAL_IMPRESSION_TERMS)
+
+# Impression terms indicating extreme events
+EXTREME_IMPRESSION_TERMS = ['excessive','frequent']
+EXTREME_IMPRESSION_RE = fuse_patterns(EXTREME_IMPRESSION_TERMS)
 
 ######################################################################################################
 ##### HELPER FUNCTIONS
@@ -110,12 +267,10 @@ def eval_interp_with_negex(interp):
     if is_not_abnormal_interp(interp):
         return NO_SEIZURE_VAL
     
-    parsed_interp = spacy_en(interp)
     neg_found = 0
     seizure_found_and_no_neg = 0
 
-    for sent in parsed_interp.sents:
-        s = str(sent)
+    for s in segment_sentences(interp):
         m1 = BASIC_NEGEX_RE.search(s)
         if m1:
             neg_found=1
@@ -135,29 +290,95 @@ def eval_interp_with_negex(interp):
 
     return NO_SEIZURE_VAL
         
+def _section_text(container, key):
+    # container[key] if it is a string, else None
+    if isinstance(container, Mapping):
+        value = container.get(key)
+        if isinstance(value, str):
+            return value
+    return None
+
+class SectionIndex(object):
+    """
+    Section texts of one EEGNote, each alias resolved against the top
+    level, narrative and findings sections once with whitespace
+    normalized, and each requested list of aliases joined once
+    """
+
+    def __init__(self, doc):
+        self.sections = doc.sections
+        self._aliases = {}
+        self._joined = {}
+
+    def alias_text(self, section):
+        """
+        Normalized text of section at the top level ('text' field), in the
+        narrative and in the findings, joined in that order
+        """
+        text = self._aliases.get(section)
+        if text is None:
+            sections = self.sections
+            parts = []
+            if isinstance(sections, Mapping):
+                for part in (_section_text(sections.get(section), 'text'),
+                             _section_text(sections.get('narrative'), section),
+                             _section_text(sections.get('findings'), section)):
+                    if part is not None:
+                        parts.extend(part.split())
+            text = ' '.join(parts)
+            self._aliases[section] = text
+        return text
+
+    def get(self, section_names):
+        """
+        Normalized text of every alias in section_names, joined
+        """
+        key = tuple(section_names)
+        text = self._joined.get(key)
+        if text is None:
+            text = ' '.join(t for t in map(self.alias_text, key) if t)
+            self._joined[key] = text
+        return text
+
+def section_index(doc):
+    """
+    SectionIndex of doc, memoized on the report and shared by every LF
+    applied to it
+    """
+    memo = report_memo(doc)
+    index = memo.get(SectionIndex)
+    if index is None:
+        index = memo.setdefault(SectionIndex, SectionIndex(doc))
+    return index
+
 def get_section_with_name(section_names, doc):
     """
     Check exact matches for keys in section_names;
     this presumes a certain structure in EEGNote doc object
     """
-    text = ''
-    for section in section_names:
-        try: 
-            text = ' '.join([text, doc.sections[section]['text']])
-        except:
-            pass
-        
-        try:
-            text = ' '.join([text, doc.sections['narrative'][section]])
-        except:
-            pass
-        
-        try:
-            text = ' '.join([text, doc.sections['findings'][section]])
-        except:
-            pass
-        
-    return ' '.join(text.split())
+    return section_index(doc).get(section_names)
+
+def negex_interp_texts(report):
+    """
+    Interpretation texts the negex LFs segment into sentences for report
+    """
+    texts = []
+    for topkey in CANDIDATE_INTERPS_LOWER:
+        if topkey in report.sections.keys():
+            texts.append(report.sections[topkey]['text'])
+            break
+    candtext = get_section_with_name(CANDIDATE_INTERPS_LOWER, report)
+    if candtext:
+        texts.append(candtext)
+    return [text for text in texts if not is_not_abnormal_interp(text)]
+
+def prefetch_report_sentences(reports, segmenter=None, batch_size=64, n_process=1):
+    """
+    Segments the interpretation texts of a chunk of reports in one batch,
+    so the negex LFs on these reports only hit the sentence cache
+    """
+    texts = [text for report in reports for text in negex_interp_texts(report)]
+    prefetch_sentences(texts, segmenter, batch_size=batch_size, n_process=n_process)
 
 ######################################################################################################
 ##### LABELING FUNCTIONS (LFs)
@@ -280,6 +501,10 @@ def lf_findall_interp_negex_seizure(report):
     else:
         return ABSTAIN_VAL
 
+# Batch hook run on each chunk of reports before these LFs are applied
+lf_abnl_interp_negexsp_seizure.prefetch = prefetch_report_sentences
+lf_findall_interp_negex_seizure.prefetch = prefetch_report_sentences
+
 def lf_seizure_section(report):
     """
     Checking to see if there is a 'seizure' section in the report
@@ -306,12 +531,8 @@ def lf_impression_section_negative(report):
     """
     Getting impression section, checking for specific terms
     """
-    impression_words = ['impression','interpretation','comments']
-    impression = get_section_with_name(impression_words, report)
-    reg_normal = ['no epileptiform', 'absence of epileptiform', 'not epileptiform', 
-                  'normal EEG', 'normal aEEG','benign','non-specific','nonepileptic','idiopathic',
-                  'no seizures','EEG is normal','normal study']
-    if any([re.search(reg, impression, re.IGNORECASE) for reg in reg_normal] ):
+    impression = get_section_with_name(IMPRESSION_WORDS, report)
+    if NORMAL_IMPRESSION_RE.search(impression):
         return NO_SEIZURE_VAL
     else:
         return ABSTAIN_VAL
@@ -320,12 +541,8 @@ def lf_impression_section_positive(report):
     """
     Getting impression section, checking for specific terms
     """
-    impression_words = ['impression','interpretation','comments']
-    impression = get_section_with_name(impression_words, report)
-
-    reg_abnormal = ['status epilepticus','spasms','abnormal continuous',
-                    'tonic','subclinical','spike-wave', 'markedly abnormal']  
-    if any([re.search(reg, impression, re.IGNORECASE) for reg in reg_abnormal] ):
+    impression = get_section_with_name(IMPRESSION_WORDS, report)
+    if ABNORMAL_IMPRESSION_RE.search(impression):
         return SEIZURE_VAL
     else:
         return ABSTAIN_VAL
@@ -334,9 +551,8 @@ def lf_spikes_in_impression(report):
     """
     Checking for indications of spikes in the impression section
     """
-    impression_words = ['impression','interpretation','comments']
-    impression = get_section_with_name(impression_words, report)
-    if re.search('spike',impression,re.IGNORECASE):
+    impression = get_section_with_name(IMPRESSION_WORDS, report)
+    if SPIKE_RE.search(impression):
         return SEIZURE_VAL
     else:
         return ABSTAIN_VAL
@@ -345,10 +561,8 @@ def lf_extreme_words_in_impression(report):
     """
     Checking for words indicating extreme events in the impression section
     """
-    impression_words = ['impression','interpretation','comments']
-    impression = get_section_with_name(impression_words, report)
-    reg_abnormal = ['excessive','frequent']
-    if any([re.search(reg, impression, re.IGNORECASE) for reg in reg_abnormal] ):
+    impression = get_section_with_name(IMPRESSION_WORDS, report)
+    if EXTREME_IMPRESSION_RE.search(impression):
         return SEIZURE_VAL
     else:
         return ABSTAIN_VAL
@@ -1,10 +1,30 @@
 import re
 
+from composite import composite_lf
+from negation import ANY_TOKEN, NegationWindow
+from patterns import compile_pattern
+
 # Setting LF output values
 ABSTAIN_VAL = 0
 HEMORRHAGE_VAL = 1
 NO_HEMORRHAGE_VAL = -1
 
+######################################################################################################
+##### HELPFUL REGEXES
+######################################################################################################
+
+# Standard normal phrases
+reg_normal_V01 = compile_pattern('Normal CT of the Head',re.IGNORECASE)
+reg_normal_V02 = compile_pattern('No acute intracranial abnormality',re.IGNORECASE)
+reg_normal_V03 = compile_pattern('Normal noncontrast and postcontrast CT',re.IGNORECASE)
+reg_normal_V04 = compile_pattern('Negative acute CT of the head',re.IGNORECASE)
+
+# Positive and negated mentions of bleeds
+reg_hemorrhage = compile_pattern('hemorrhage',re.IGNORECASE)
+neg_hemorrhage = NegationWindow('(hemorrhage)',token=ANY_TOKEN)
+reg_hematoma = compile_pattern('hematoma',re.IGNORECASE)
+neg_hematoma = NegationWindow('(hematoma)',triggers=('No','without','resolution','scalp','subgaleal'),token=ANY_TOKEN)
+
 ######################################################################################################
 ##### LABELING FUNCTIONS (LFs)
 ######################################################################################################
@@ -13,9 +33,8 @@ def LF_normal_V01(report):
     """
     Checking for specific normal phrase
     """
-    r = re.compile('Normal CT of the Head',re.IGNORECASE)
     for s in report.report.sentences:
-        if r.search(s.text):
+        if reg_normal_V01.search(s.text):
             return NO_HEMORRHAGE_VAL
     return ABSTAIN_VAL 
 
@@ -23,9 +42,8 @@ def LF_normal_V02(report):
     """
     Checking for specific normal phrase
     """
-    r = re.compile('No acute intracranial abnormality',re.IGNORECASE)
     for s in report.report.sentences:
-        if r.search(s.text):
+        if reg_normal_V02.search(s.text):
             return NO_HEMORRHAGE_VAL
     return ABSTAIN_VAL 
 
@@ -33,9 +51,8 @@ def LF_normal_V03(report):
     """
     Checking for specific normal phrase
     """
-    r = re.compile('Normal noncontrast and postcontrast CT',re.IGNORECASE)
     for s in report.report.sentences:
-        if r.search(s.text):
+        if reg_normal_V03.search(s.text):
             return NO_HEMORRHAGE_VAL
     return ABSTAIN_VAL 
 
@@ -43,9 +60,8 @@ def LF_normal_V04(report):
     """
     Checking for specific normal phrase
     """
-    r = re.compile('Negative acute CT of the head',re.IGNORECASE)
     for s in report.report.sentences:
-        if r.search(s.text):
+        if reg_normal_V04.search(s.text):
             return NO_HEMORRHAGE_VAL
     return ABSTAIN_VAL 
 
@@ -53,10 +69,8 @@ def LF_positive_hemorrhage(report):
     """
     Checking for words indicating hemorrhage
     """
-    r1 = re.compile('(No|without|resolution)\\s([\S]*\\s){0,10}(hemorrhage)',re.IGNORECASE)
-    r = re.compile('hemorrhage',re.IGNORECASE)
     for s in report.report.sentences:
-        if r.search(s.text) and (not r1.search(s.text)):
+        if reg_hemorrhage.search(s.text) and (not neg_hemorrhage.search(s.text)):
             return HEMORRHAGE_VAL
     return ABSTAIN_VAL
 
@@ -64,17 +78,16 @@ def LF_positive_hematoma(report):
     """
     Checking for words indicating hematoma
     """
-    r1 = re.compile('(No|without|resolution|scalp|subgaleal)\\s([\S]*\\s){0,10}(hematoma)',re.IGNORECASE)
-    r = re.compile('hematoma',re.IGNORECASE)
     for s in report.report.sentences:
-        if r.search(s.text) and (not r1.search(s.text)):
+        if reg_hematoma.search(s.text) and (not neg_hematoma.search(s.text)):
             return HEMORRHAGE_VAL
     return ABSTAIN_VAL
 
-def LF_hemorrhage_hi_cover(report):
+@composite_lf(LF_positive_hemorrhage, LF_positive_hematoma)
+def LF_hemorrhage_hi_cover(hemorrhage, hematoma):
     """
     Checking for both hemorrhage and hematoma
     """
-    if LF_positive_hemorrhage(report) == 0 and LF_positive_hematoma(report) == 0:
+    if hemorrhage == 0 and hematoma == 0:
         return NO_HEMORRHAGE_VAL
     return HEMORRHAGE_VAL
\ No newline at end of file
@@ -1,5 +1,10 @@
 import re
 
+from docview import as_doc
+from keyword_matcher import KeywordMatcher
+from negation import NegationWindow
+from patterns import EQUIVOCATION, compile_pattern
+
 # Setting LF output values
 ABSTAIN_VAL = 0
 ABNORMAL_VAL = 1
@@ -9,7 +14,41 @@ NORMAL_VAL = -1
 ##### HELPFUL REGEXES AND ONTOLOGIES
 ######################################################################################################
 
-reg_equivocation = re.compile('unlikely|likely|suggests|questionable|concerning|possibly|potentially|could represent|may represent|may relate|cannot exclude|can\'t exclude|may be',re.IGNORECASE)
+reg_equivocation = compile_pattern(EQUIVOCATION,re.IGNORECASE)
+
+# Disease categories
+disease_categories = ['normal','opacity','cardiomegaly','calcinosis',
+                      'lung/hypoinflation','calcified granuloma',
+                      'thoracic vertebrae/degenerative','lung/hyperdistention',
+                      'spine/degenerative','catheters, indwelling',
+                      'granulomatous disease','nodule','surgical instruments',
+                      'scoliosis', 'osteophyte', 'spondylosis','fractures, bone']
+reg_disease_pos = [compile_pattern(cat,re.IGNORECASE) for cat in disease_categories]
+neg_disease = [NegationWindow(cat) for cat in disease_categories]
+
+# Negated mentions of fractures and lesions
+neg_fracture = NegationWindow('fracture')
+neg_lesion = NegationWindow('(lesion|tumor|mass)')
+
+# Regexes for specific findings
+reg_no_degenerative = compile_pattern('No significant degenerative change',re.IGNORECASE)
+reg_degen = compile_pattern('degen',re.IGNORECASE)
+reg_spine = compile_pattern('spine',re.IGNORECASE)
+reg_fracture = compile_pattern('fracture',re.IGNORECASE)
+reg_fracture_1 = compile_pattern('(linear|curvilinear)\\slucency',re.IGNORECASE)
+reg_fracture_2 = compile_pattern('(impaction|distraction|diastasis|displaced|foreshortened|angulation|rotation)',re.IGNORECASE)
+reg_fracture_3 = compile_pattern('(transverse|oblique)',re.IGNORECASE)
+reg_lesion_1 = compile_pattern('(moth-eaten|permeative|chondroid|ground-glass|lucent|sclerotic)',re.IGNORECASE)
+reg_lesion_2 = compile_pattern('(margin|circumscribed|indistinct)',re.IGNORECASE)
+reg_lesion_3 = compile_pattern('(non-linear|lucency)',re.IGNORECASE)
+reg_surgical = compile_pattern('surgical',re.IGNORECASE)
+
+# Keyword lists of the substring LFs, matched in one pass over the lowercased report
+report_keywords = KeywordMatcher(lower=True)
+kw_no_evidence = report_keywords.add(["no evidence of fracture"])
+kw_negative_quantifiers = report_keywords.add(["severe", "multiple"])
+kw_disease = report_keywords.add(["disease"])
+kw_screw = report_keywords.add(["screw"])
 
 ######################################################################################################
 ##### LABELING FUNCTIONS (LFs)
@@ -19,9 +58,8 @@ def LF_no_degenerative(report):
     """
     Checking for degenerative change 
     """
-    r = re.compile('No significant degenerative change',re.IGNORECASE)
-    for s in report.report_text.text.split("."):
-        if r.search(s):
+    for s in as_doc(report).sentences:
+        if reg_no_degenerative.search(s):
             return NORMAL_VAL
     return ABSTAIN_VAL
 
@@ -29,66 +67,50 @@ def LF_degen_spine(report):
     """
     Checking for degenerative spine
     """
-    reg_01 = re.compile('degen',re.IGNORECASE)
-    reg_02 = re.compile('spine',re.IGNORECASE)
-    for s in report.report_text.text.split("."):
-        if reg_01.search(s) and reg_02.search(s):
+    for s in as_doc(report).sentences:
+        if reg_degen.search(s) and reg_spine.search(s):
             return ABNORMAL_VAL
     return ABSTAIN_VAL
 
 def LF_fracture_general(report):
-    reg_pos = re.compile('fracture',re.IGNORECASE)
-    reg_neg = re.compile('(No|without|resolution)\\s([a-zA-Z0-9\-,_]*\\s){0,10}fracture',re.IGNORECASE)
-    for s in report.report_text.text.split("."):
-        if reg_pos.search(s) and (not reg_neg.search(s)) and (not reg_equivocation.search(s)):
+    for s in as_doc(report).sentences:
+        if reg_fracture.search(s) and (not neg_fracture.search(s)) and (not reg_equivocation.search(s)):
             return ABNORMAL_VAL
     return ABSTAIN_VAL
 
 def LF_fracture_1(report):
-    reg_pos = re.compile('(linear|curvilinear)\\slucency',re.IGNORECASE)
-    reg_neg = re.compile('(No|without|resolution)\\s([a-zA-Z0-9\-,_]*\\s){0,10}fracture',re.IGNORECASE)
-    for s in report.report_text.text.split("."):
-        if reg_pos.search(s) and (not reg_neg.search(s)) and (not reg_equivocation.search(s)):
+    for s in as_doc(report).sentences:
+        if reg_fracture_1.search(s) and (not neg_fracture.search(s)) and (not reg_equivocation.search(s)):
             return ABNORMAL_VAL
     return ABSTAIN_VAL
 
 def LF_fracture_2(report):
-    reg_pos = re.compile('(impaction|distraction|diastasis|displaced|foreshortened|angulation|rotation)',re.IGNORECASE)
-    reg_neg = re.compile('(No|without|resolution)\\s([a-zA-Z0-9\-,_]*\\s){0,10}fracture',re.IGNORECASE)
-    for s in report.report_text.text.split("."):
-        if reg_pos.search(s) and (not reg_neg.search(s)) and (not reg_equivocation.search(s)):
+    for s in as_doc(report).sentences:
+        if reg_fracture_2.search(s) and (not neg_fracture.search(s)) and (not reg_equivocation.search(s)):
             return ABNORMAL_VAL
     return ABSTAIN_VAL
 
 def LF_fracture_3(report):
-    reg_pos = re.compile('(transverse|oblique)',re.IGNORECASE)
-    reg_neg = re.compile('(No|without|resolution)\\s([a-zA-Z0-9\-,_]*\\s){0,10}fracture',re.IGNORECASE)
-    for s in report.report_text.text.split("."):
-        if reg_pos.search(s) and (not reg_neg.search(s)) and (not reg_equivocation.search(s)):
+    for s in as_doc(report).sentences:
+        if reg_fracture_3.search(s) and (not neg_fracture.search(s)) and (not reg_equivocation.search(s)):
             return ABNORMAL_VAL
     return ABSTAIN_VAL
 
 def LF_lesion_1(report):
-    reg_pos = re.compile('(moth-eaten|permeative|chondroid|ground-glass|lucent|sclerotic)',re.IGNORECASE)
-    reg_neg = re.compile('(No|without|resolution)\\s([a-zA-Z0-9\-,_]*\\s){0,10}(lesion|tumor|mass)',re.IGNORECASE)
-    for s in report.report_text.text.split("."):
-        if reg_pos.search(s) and (not reg_neg.search(s)) and (not reg_equivocation.search(s)):
+    for s in as_doc(report).sentences:
+        if reg_lesion_1.search(s) and (not neg_lesion.search(s)) and (not reg_equivocation.search(s)):
             return ABNORMAL_VAL
     return ABSTAIN_VAL
 
 def LF_lesion_2(report):
-    reg_pos = re.compile('(margin|circumscribed|indistinct)',re.IGNORECASE)
-    reg_neg = re.compile('(No|without|resolution)\\s([a-zA-Z0-9\-,_]*\\s){0,10}(lesion|tumor|mass)',re.IGNORECASE)
-    for s in report.report_text.text.split("."):
-        if reg_pos.search(s) and (not reg_neg.search(s)) and (not reg_equivocation.search(s)):
+    for s in as_doc(report).sentences:
+        if reg_lesion_2.search(s) and (not neg_lesion.search(s)) and (not reg_equivocation.search(s)):
             return ABNORMAL_VAL
     return ABSTAIN_VAL
 
 def LF_lesion_3(report):
-    reg_pos = re.compile('(non-linear|lucency)',re.IGNORECASE)
-    reg_neg = re.compile('(No|without|resolution)\\s([a-zA-Z0-9\-,_]*\\s){0,10}(lesion|tumor|mass)',re.IGNORECASE)
-    for s in report.report_text.text.split("."):
-        if reg_pos.search(s) and (not reg_neg.search(s)) and (not reg_equivocation.search(s)):
+    for s in as_doc(report).sentences:
+        if reg_lesion_3.search(s) and (not neg_lesion.search(s)) and (not reg_equivocation.search(s)):
             return ABNORMAL_VAL
     return ABSTAIN_VAL
 
@@ -96,9 +118,8 @@ def LF_surgical(report):
     """
     Checking for post-surgical change
     """
-    reg_01 = re.compile('surgical',re.IGNORECASE)
-    for s in report.report_text.text.split("."):
-        if reg_01.search(s):
+    for s in as_doc(report).sentences:
+        if reg_surgical.search(s):
             return ABNORMAL_VAL
     return ABSTAIN_VAL
 
@@ -106,11 +127,10 @@ def LF_no_significant(c):
     """
     Checking for indications of negligible issues
     """
-    report = c.report_text.text
-    report = report[:report.find("SUMMARY:")]
-    if "no significant" in report.lower()\
-        or "no immediate" in report.lower()\
-            or "demonstrate no" in report.lower():
+    report = as_doc(c).section_lower(end="SUMMARY:")
+    if "no significant" in report\
+        or "no immediate" in report\
+            or "demonstrate no" in report:
         return NORMAL_VAL
     else:
         return ABSTAIN_VAL
@@ -119,7 +139,7 @@ def LF_no_evidence(c):
     """
     Checking for evidence of fracture
     """
-    if "no evidence of fracture" in c.report_text.text.lower():
+    if report_keywords.hits(c) & kw_no_evidence:
         return NORMAL_VAL
     else:
         return ABSTAIN_VAL
@@ -130,9 +150,10 @@ def LF_report_length(c):
     """
     long_cut = 600
     short_cut = 500
-    if len(c.report_text.text) < short_cut:
+    ln = len(as_doc(c).text)
+    if ln < short_cut:
         return NORMAL_VAL
-    elif len(c.report_text.text) > long_cut: 
+    elif ln > long_cut: 
         return ABNORMAL_VAL
     else :
         return ABSTAIN_VAL
@@ -141,31 +162,23 @@ def LF_negative_quantifiers_in_report(c):
     """
     Searching for indications of multiple or sever pathologies
     """
-    negative_quantifiers = ["severe", "multiple"]
-    return ABNORMAL_VAL if any(word in c.report_text.text.lower() \
-                    for word in negative_quantifiers) else ABSTAIN_VAL
+    return ABNORMAL_VAL if report_keywords.hits(c) & kw_negative_quantifiers else ABSTAIN_VAL
 
 def LF_disease_in_report(c):
     """
     Checking for word "disease"
     """
-    return ABNORMAL_VAL if "disease" in c.report_text.text.lower() else ABSTAIN_VAL
+    return ABNORMAL_VAL if report_keywords.hits(c) & kw_disease else ABSTAIN_VAL
 
 def LF_positive_disease_term(report):
     """
     Checking for positive disease term
     """
-    categories = ['normal','opacity','cardiomegaly','calcinosis',
-              'lung/hypoinflation','calcified granuloma',
-              'thoracic vertebrae/degenerative','lung/hyperdistention',
-              'spine/degenerative','catheters, indwelling',
-              'granulomatous disease','nodule','surgical instruments',
-              'scoliosis', 'osteophyte', 'spondylosis','fractures, bone']
-    for idx in range(1,len(categories)):
-        reg_pos = re.compile(categories[idx],re.IGNORECASE)
-        reg_neg = re.compile('(No|without|resolution)\\s([a-zA-Z0-9\-,_]*\\s){0,10}'+categories[idx],re.IGNORECASE)
-        for s in report.report_text.text.split("."):
-            if reg_pos.search(s) and (not reg_neg.search(s)) and (not reg_equivocation.search(s)):
+    for idx in range(1,len(disease_categories)):
+        reg_pos = reg_disease_pos[idx]
+        neg = neg_disease[idx]
+        for s in as_doc(report).sentences:
+            if reg_pos.search(s) and (not neg.search(s)) and (not reg_equivocation.search(s)):
                 return ABNORMAL_VAL
     return ABSTAIN_VAL
 
@@ -177,13 +190,10 @@ def LF_consistency_in_report(c):
     
     words_indicating_normalcy = ['clear', 'no', 'normal', 'unremarkable',
                                  'preserved', 'mild']
-    report = c.report_text.text
-    findings = report
-    sents = findings.split('.')
+    sents = as_doc(c).lower().split('.')
 
     num_sents_without_normal = 0
     for sent in sents:
-        sent = sent.lower()
         if not any(word in sent for word in words_indicating_normalcy):
             num_sents_without_normal += 1
         elif 'not' in sent:
@@ -197,4 +207,4 @@ def LF_screw(c):
     """
     Checking if a screw is mentioned
     """
-    return ABNORMAL_VAL if "screw" in c.report_text.text.lower() else ABSTAIN_VAL
+    return ABNORMAL_VAL if report_keywords.hits(c) & kw_screw else ABSTAIN_VAL
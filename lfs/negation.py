@@ -0,0 +1,171 @@
+import re
+from functools import lru_cache
+
+from patterns import compile_pattern
+
+######################################################################################################
+##### NEGATION SCOPE
+######################################################################################################
+
+# Default negation triggers
+NEGATION_TRIGGERS = ('No', 'without', 'resolution')
+
+# Characters allowed in the tokens between a trigger and its target
+WINDOW_TOKEN = r'[a-zA-Z0-9\-,_]'
+
+# Any non-whitespace token
+ANY_TOKEN = r'[\S]'
+
+WHITESPACE_RE = re.compile(r'\s')
+
+class SentenceTokens(object):
+    """
+    A sentence split at every whitespace character, with per-token flags
+    computed once and shared by all windows that test the same sentence
+    """
+
+    __slots__ = ('text', 'tokens', 'starts', '_flags')
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = WHITESPACE_RE.split(text)
+        starts = []
+        pos = 0
+        for token in self.tokens:
+            starts.append(pos)
+            pos += len(token) + 1
+        self.starts = starts
+        self._flags = {}
+
+    def flags(self, regex):
+        """
+        Per-token results of regex.search, cached by regex
+        """
+        flags = self._flags.get(regex)
+        if flags is None:
+            search = regex.search
+            flags = [search(token) is not None for token in self.tokens]
+            self._flags[regex] = flags
+        return flags
+
+
+@lru_cache(maxsize=4096)
+def tokenize(sentence):
+    """
+    Tokenizes a sentence once; repeated boilerplate sentences hit the cache
+    """
+    return SentenceTokens(sentence)
+
+class NegationWindow(object):
+    """
+    Linear-time equivalent of the negation regexes
+
+        (trigger|...)\\s(TOKEN*\\s){0,max_tokens}target
+
+    A match needs a token ending in a trigger, followed by at most
+    max_tokens tokens made only of TOKEN characters, followed by a token
+    where target matches. Only tokens ending in a trigger are ever
+    extended, so long run-on sentences cannot cause backtracking.
+    """
+
+    def __init__(self, target, triggers=NEGATION_TRIGGERS, max_tokens=10,
+                 token=WINDOW_TOKEN, flags=re.IGNORECASE):
+        self.target = target
+        self.triggers = tuple(triggers)
+        self.max_tokens = max_tokens
+        self.token = token
+        self.flags = flags
+        # Regex this window reproduces
+        self.pattern = (f'({"|".join(self.triggers)})\\s({token}*\\s)'
+                        f'{{0,{max_tokens}}}{target}')
+        self._target_re = compile_pattern(target, flags)
+        self._trigger_re = compile_pattern(f'(?:{"|".join(self.triggers)})\\Z', flags)
+        self._token_re = None if token == ANY_TOKEN else compile_pattern(f'\\A{token}*\\Z', flags)
+
+    def __repr__(self):
+        return f'NegationWindow({self.pattern!r}, flags={self.flags})'
+
+    def search(self, sentence):
+        """
+        Returns True if sentence contains a negated mention of target
+        """
+        if not self._target_re.search(sentence):
+            return False
+        tokens = tokenize(sentence)
+        triggered = tokens.flags(self._trigger_re)
+        if not any(triggered):
+            return False
+        plain = None if self._token_re is None else tokens.flags(self._token_re)
+        match = self._target_re.match
+        starts = tokens.starts
+        n = len(starts)
+        for i in range(n - 1):
+            if not triggered[i]:
+                continue
+            for j in range(i + 1, min(i + 2 + self.max_tokens, n)):
+                if match(sentence, starts[j]):
+                    return True
+                if plain is not None and not plain[j]:
+                    break
+        return False
+
+def find_windows(*modules):
+    """
+    Collects the NegationWindow objects defined at the top level of modules
+    """
+    windows = []
+    for module in modules:
+        for value in vars(module).values():
+            candidates = value if isinstance(value, (list, tuple)) else [value]
+            windows.extend(w for w in candidates if isinstance(w, NegationWindow))
+    return windows
+
+def check_equivalence(windows, sentences):
+    """
+    Compares every window with the regex it replaces on sentences;
+    returns a list of (pattern, sentence) disagreements
+    """
+    mismatches = []
+    for window in windows:
+        regex = re.compile(window.pattern, window.flags)
+        for sentence in sentences:
+            if window.search(sentence) != bool(regex.search(sentence)):
+                mismatches.append((window.pattern, sentence))
+    return mismatches
+
+
+if __name__ == '__main__':
+    import csv
+    import os
+    import random
+    import sys
+
+    # The LF modules import this script as negation, so their windows are
+    # instances of this NegationWindow class
+    sys.modules.setdefault('negation', sys.modules[__name__])
+    import lfs_cxr
+    import lfs_hct
+    import lfs_msk
+
+    default_csv = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                               'openi_demo', 'data', 'train_entries.csv')
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else default_csv
+    with open(csv_path) as fin:
+        sentences = [s for row in csv.DictReader(fin) for s in row['text'].split('.')]
+
+    # Synthetic sentences around window boundaries and odd whitespace
+    rng = random.Random(0)
+    vocab = ['no', 'No', 'piano', 'without', 'resolution', '(no', 'fracture', 'fractures',
+             'hemorrhage', 'hematoma', 'scalp', 'lesion', 'mass', 'nodule', 'opacity',
+             'acute', 'rib', 'a', '4-mm', 'left,', 'x/y', '(old)', '', 'calcified granuloma']
+    seps = [' ', ' ', ' ', '  ', '\t', '\n']
+    for _ in range(20000):
+        words = [rng.choice(vocab) for _ in range(rng.randint(1, 16))]
+        sentences.append(''.join(w + rng.choice(seps) for w in words).strip(' '))
+
+    windows = find_windows(lfs_cxr, lfs_msk, lfs_hct)
+    mismatches = check_equivalence(windows, sentences)
+    print(f'{len(windows)} windows, {len(sentences)} sentences, {len(mismatches)} mismatches')
+    for pattern, sentence in mismatches[:10]:
+        print(f'  {pattern!r}: {sentence!r}')
+    sys.exit(1 if mismatches else 0)
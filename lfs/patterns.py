@@ -0,0 +1,86 @@
+import re
+import time
+
+######################################################################################################
+##### SHARED PATTERN STRINGS
+######################################################################################################
+
+# Equivocation terms
+EQUIVOCATION = 'unlikely|likely|suggests|questionable|concerning|possibly|potentially|could represent|may represent|may relate|cannot exclude|can\'t exclude|may be'
+
+######################################################################################################
+##### PATTERN REGISTRY
+######################################################################################################
+
+class PatternRegistry(object):
+    """
+    Compiles every regex used by the LF modules exactly once and hands out
+    the compiled object, so LFs never pay for re.compile at call time.
+
+    Compile time is accumulated as patterns are registered; match time is
+    only measured on request via time_matches, which keeps the LF hot path
+    free of any bookkeeping.
+    """
+
+    def __init__(self):
+        self._patterns = {}
+        self.compile_count = 0
+        self.compile_time = 0.0
+
+    def compile(self, pattern, flags=0):
+        """
+        Returns the compiled pattern for (pattern, flags), compiling it on
+        first use
+        """
+        key = (pattern, flags)
+        compiled = self._patterns.get(key)
+        if compiled is None:
+            start = time.perf_counter()
+            compiled = re.compile(pattern, flags)
+            self.compile_time += time.perf_counter() - start
+            self.compile_count += 1
+            self._patterns[key] = compiled
+        return compiled
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def __iter__(self):
+        return iter(self._patterns.values())
+
+    def time_matches(self, texts):
+        """
+        Runs search for every registered pattern over texts and returns
+        a list of (pattern, flags, seconds) sorted slowest first
+        """
+        timings = []
+        for (pattern, flags), compiled in self._patterns.items():
+            search = compiled.search
+            start = time.perf_counter()
+            for text in texts:
+                search(text)
+            timings.append((pattern, flags, time.perf_counter() - start))
+        return sorted(timings, key=lambda t: t[2], reverse=True)
+
+    def report(self, texts):
+        """
+        Summarizes compile vs. match time for the registered patterns
+        """
+        timings = self.time_matches(texts)
+        match_time = sum(t[2] for t in timings)
+        lines = [f'{len(self)} patterns, {self.compile_count} compiles: '
+                 f'compile {self.compile_time:.4f}s, match {match_time:.4f}s '
+                 f'over {len(texts)} texts']
+        for pattern, flags, seconds in timings:
+            lines.append(f'  {seconds:.4f}s  {pattern[:70]}')
+        return '\n'.join(lines)
+
+
+# Registry shared by every LF module
+PATTERNS = PatternRegistry()
+
+def compile_pattern(pattern, flags=0):
+    """
+    Compiles pattern through the shared registry
+    """
+    return PATTERNS.compile(pattern, flags)
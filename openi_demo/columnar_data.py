@@ -0,0 +1,255 @@
+import argparse
+import ast
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Columns of the split CSVs holding stringified Python lists of labels
+LIST_COLUMNS = ('major_label', 'top_label')
+
+# CSV rows parsed and appended per conversion step
+DEFAULT_ROWS_PER_CHUNK = 100000
+
+META_FILE = 'meta.json'
+
+######################################################################################################
+##### COLUMNS
+######################################################################################################
+
+class StringColumn(object):
+    """
+    A column of strings stored Arrow-style: the UTF-8 bytes of every value
+    back to back in data, value i spanning data[offsets[i]:offsets[i+1]],
+    with missing values marked False in valid (None if there are none)
+    """
+
+    def __init__(self, data, offsets, valid=None):
+        self.data = data
+        self.offsets = offsets
+        self.valid = valid
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if self.valid is not None and not self.valid[idx]:
+            return None
+        return bytes(self.data[self.offsets[idx]:self.offsets[idx + 1]]).decode('utf-8')
+
+    def tolist(self):
+        """
+        All values, decoded in one pass over the buffer
+        """
+        buf = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        values = [buf[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+        if self.valid is not None and not self.valid.all():
+            for idx in np.flatnonzero(~self.valid).tolist():
+                values[idx] = None
+        return values
+
+
+class ListColumn(object):
+    """
+    A column of string lists: list i holds items[list_offsets[i]:list_offsets[i+1]]
+    """
+
+    def __init__(self, list_offsets, items):
+        self.list_offsets = list_offsets
+        self.items = items
+
+    def __len__(self):
+        return len(self.list_offsets) - 1
+
+    def __getitem__(self, idx):
+        return [self.items[item] for item in range(self.list_offsets[idx], self.list_offsets[idx + 1])]
+
+    def tolist(self):
+        items = self.items.tolist()
+        offsets = self.list_offsets.tolist()
+        return [items[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+######################################################################################################
+##### CONVERSION
+######################################################################################################
+
+class _ColumnWriter(object):
+    """
+    Appends the chunks of one column to its raw buffer files
+    """
+
+    def __init__(self, out_dir, name, kind, dtype=None):
+        self.out_dir = out_dir
+        self.name = name
+        self.kind = kind
+        self.dtype = dtype
+        self.files = {}
+        self.n_bytes = 0
+        self.n_items = 0
+        if kind in ('string', 'list'):
+            self._write('offsets', np.zeros(1, dtype=np.int64))
+        if kind == 'list':
+            self._write('list_offsets', np.zeros(1, dtype=np.int64))
+
+    def _write(self, buffer, values):
+        if buffer not in self.files:
+            self.files[buffer] = open(os.path.join(self.out_dir, f'{self.name}.{buffer}.bin'), 'wb')
+        self.files[buffer].write(np.ascontiguousarray(values).tobytes())
+
+    def _append_strings(self, values):
+        encoded = [value.encode('utf-8') for value in values]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        self._write('data', np.frombuffer(b''.join(encoded), dtype=np.uint8))
+        self._write('offsets', self.n_bytes + np.cumsum(lengths))
+        self.n_bytes += int(lengths.sum())
+
+    def append(self, series):
+        if self.kind == 'numeric':
+            try:
+                self._write('values', series.to_numpy().astype(self.dtype, casting='same_kind'))
+            except (TypeError, ValueError):
+                raise ValueError(f'Column {self.name} does not fit its first chunk\'s dtype {self.dtype}')
+        elif self.kind == 'string':
+            valid = series.notna().to_numpy()
+            self._write('valid', valid)
+            self._append_strings([value if ok else '' for value, ok in zip(series.tolist(), valid)])
+        else:
+            lists = [ast.literal_eval(value) if isinstance(value, str) else [] for value in series.tolist()]
+            lengths = np.fromiter(map(len, lists), dtype=np.int64, count=len(lists))
+            self._write('list_offsets', self.n_items + np.cumsum(lengths))
+            self.n_items += int(lengths.sum())
+            self._append_strings([str(item) for items in lists for item in items])
+
+    def close(self):
+        for fout in self.files.values():
+            fout.close()
+        return {'kind': self.kind, 'dtype': self.dtype}
+
+
+def convert_csv(csv_path, out_dir, list_columns=LIST_COLUMNS, rows_per_chunk=DEFAULT_ROWS_PER_CHUNK):
+    """
+    Converts a split CSV into a directory of raw little-endian column
+    buffers plus a meta.json describing them, parsing the stringified
+    label lists of list_columns once. Numeric columns keep the dtype
+    pandas infers for the first chunk; every other column is stored as
+    strings. The CSV is read rows_per_chunk rows at a time, and meta.json
+    is written last, so a directory without one is an incomplete
+    conversion.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    meta_path = os.path.join(out_dir, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    writers = None
+    n_rows = 0
+    for chunk in pd.read_csv(csv_path, index_col=0, chunksize=rows_per_chunk):
+        if writers is None:
+            writers = []
+            for name in chunk.columns:
+                dtype = chunk[name].dtype
+                if name in list_columns:
+                    writers.append(_ColumnWriter(out_dir, name, 'list'))
+                elif dtype.kind in 'biuf':
+                    writers.append(_ColumnWriter(out_dir, name, 'numeric', dtype.newbyteorder('<').str))
+                else:
+                    writers.append(_ColumnWriter(out_dir, name, 'string'))
+        for writer in writers:
+            writer.append(chunk[writer.name])
+        n_rows += len(chunk)
+    meta = {
+        'source': os.path.abspath(csv_path),
+        'n_rows': n_rows,
+        'columns': {writer.name: writer.close() for writer in writers or []},
+    }
+    with open(meta_path, 'w') as fout:
+        json.dump(meta, fout, indent=1)
+    return ColumnarSplit(out_dir)
+
+def is_converted(csv_path, out_dir):
+    """
+    Whether out_dir holds a complete conversion newer than csv_path
+    """
+    meta_path = os.path.join(out_dir, META_FILE)
+    return os.path.exists(meta_path) and os.path.getmtime(meta_path) >= os.path.getmtime(csv_path)
+
+######################################################################################################
+##### LOADING
+######################################################################################################
+
+class ColumnarSplit(object):
+    """
+    A split written by convert_csv. Columns are opened on first access,
+    memory-mapped (read-only) unless mmap is False, so reading a few
+    columns of a large split touches only their buffers.
+    """
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        self.mmap = mmap
+        with open(os.path.join(path, META_FILE)) as fin:
+            self.meta = json.load(fin)
+        self.columns = list(self.meta['columns'])
+        self._columns = {}
+
+    def __len__(self):
+        return self.meta['n_rows']
+
+    def _buffer(self, name, buffer, dtype):
+        path = os.path.join(self.path, f'{name}.{buffer}.bin')
+        if not os.path.getsize(path):
+            return np.zeros(0, dtype=dtype)
+        if self.mmap:
+            return np.memmap(path, dtype=dtype, mode='r')
+        return np.fromfile(path, dtype=dtype)
+
+    def _strings(self, name):
+        return (self._buffer(name, 'data', np.uint8), self._buffer(name, 'offsets', '<i8'))
+
+    def column(self, name):
+        """
+        A numeric column as an array, a string column as a StringColumn,
+        a label list column as a ListColumn
+        """
+        if name not in self._columns:
+            spec = self.meta['columns'][name]
+            if spec['kind'] == 'numeric':
+                column = self._buffer(name, 'values', spec['dtype'])
+            elif spec['kind'] == 'string':
+                column = StringColumn(*self._strings(name), self._buffer(name, 'valid', np.bool_))
+            else:
+                column = ListColumn(self._buffer(name, 'list_offsets', '<i8'), StringColumn(*self._strings(name)))
+            self._columns[name] = column
+        return self._columns[name]
+
+    __getitem__ = column
+
+    def to_pandas(self, columns=None):
+        """
+        DataFrame of the given columns (default: all), with label lists
+        as Python lists
+        """
+        data = {}
+        for name in columns or self.columns:
+            column = self.column(name)
+            data[name] = column if isinstance(column, np.ndarray) else column.tolist()
+        return pd.DataFrame(data, columns=list(columns or self.columns))
+
+def load_split(path, columns=None, mmap=True):
+    """
+    DataFrame of the given columns of the split converted to path
+    """
+    return ColumnarSplit(path, mmap).to_pandas(columns)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert split CSVs to the columnar format')
+    parser.add_argument('csvs', nargs='+', help='split CSVs, e.g. data/train_entries.csv')
+    parser.add_argument('--out', default='data/columnar', help='one subdirectory per CSV is written here')
+    parser.add_argument('--rows-per-chunk', type=int, default=DEFAULT_ROWS_PER_CHUNK)
+    args = parser.parse_args()
+
+    for csv_path in args.csvs:
+        name = os.path.splitext(os.path.basename(csv_path))[0]
+        split = convert_csv(csv_path, os.path.join(args.out, name), rows_per_chunk=args.rows_per_chunk)
+        print(f'{csv_path}: {len(split)} rows -> {split.path}')
@@ -0,0 +1,299 @@
+import hashlib
+import inspect
+import os
+import re
+import types
+from dis import get_instructions
+
+import numpy as np
+from scipy.sparse import coo_matrix
+
+from label_matrix import DEFAULT_CHUNK_SIZE, apply_lfs
+from composite import CompositeLF
+from docview import as_doc
+from keyword_matcher import KeywordGroup
+
+# Compiled regex type (re.Pattern only exists from Python 3.7)
+PATTERN_TYPE = type(re.compile(''))
+
+HEX_DIGEST_RE = re.compile(r'[0-9a-fA-F]{64}')
+
+# Values whose repr is stable across interpreter runs
+LITERAL_TYPES = (str, bytes, int, float, bool, type(None))
+
+def _global_fingerprint(value, seen):
+    """
+    Stable description of a module-level value referenced by an LF
+    """
+    if isinstance(value, (types.FunctionType, CompositeLF)):
+        return lf_fingerprint(value, seen)
+    if isinstance(value, type):
+        return class_fingerprint(value, seen)
+    if isinstance(value, PATTERN_TYPE):
+        # repr truncates long patterns
+        return f're.compile({value.pattern!r}, {value.flags})'
+    if isinstance(value, KeywordGroup):
+        # Only the LF's own keyword list, not its bit or the other lists
+        return f'keywords{sorted(value.keywords)}'
+    if isinstance(value, (list, tuple)):
+        return repr([_global_fingerprint(item, seen) for item in value])
+    if isinstance(value, dict):
+        return repr([(_global_fingerprint(key, seen), _global_fingerprint(item, seen))
+                     for key, item in value.items()])
+    if isinstance(value, (set, frozenset)):
+        # Set iteration order depends on the per-run string hash seed
+        return repr(sorted(_global_fingerprint(item, seen) for item in value))
+    if isinstance(value, LITERAL_TYPES):
+        return repr(value)
+    # Objects behave as their class's code says
+    cls = class_fingerprint(type(value), seen)
+    if type(value).__repr__ is not object.__repr__:
+        return f'{cls}:{value!r}'
+    # Default reprs embed the object's address
+    return cls
+
+def _referenced_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _referenced_names(const)
+    return names
+
+def _assigned_names(code):
+    # Names declared global and assigned, e.g. memos: state, not behavior
+    names = {instr.argval for instr in get_instructions(code) if instr.opname == 'STORE_GLOBAL'}
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _assigned_names(const)
+    return names
+
+def _update_with_globals(digest, fn, seen):
+    # The module-level values the code of fn references
+    module_globals = fn.__globals__
+    for name in sorted(_referenced_names(fn.__code__) - _assigned_names(fn.__code__)):
+        if name in module_globals:
+            value = _global_fingerprint(module_globals[name], seen)
+            digest.update(f'{name}={value}\n'.encode('utf-8'))
+
+def class_fingerprint(cls, seen=None):
+    """
+    Hex digest of the source of a class and of its non-builtin bases,
+    plus the values of the module-level names their methods reference
+    """
+    seen = set() if seen is None else seen
+    if cls in seen or cls.__module__ == 'builtins':
+        return cls.__qualname__
+    seen.add(cls)
+    digest = hashlib.sha256()
+    for klass in cls.__mro__:
+        if klass.__module__ == 'builtins':
+            continue
+        try:
+            digest.update(inspect.getsource(klass).encode('utf-8'))
+        except (OSError, TypeError):
+            digest.update(klass.__qualname__.encode('utf-8'))
+        for attr in vars(klass).values():
+            if isinstance(attr, (staticmethod, classmethod)):
+                attr = attr.__func__
+            elif isinstance(attr, property):
+                attr = attr.fget
+            if isinstance(attr, types.FunctionType):
+                _update_with_globals(digest, attr, seen)
+    return digest.hexdigest()
+
+def lf_fingerprint(lf, seen=None):
+    """
+    Hex digest of an LF's source code plus the values of the module-level
+    names it references (keyword lists, patterns, helper functions, the
+    classes of helper objects, ...), so that editing the LF or anything it
+    reads yields a new fingerprint. An LF's columnar form (see
+    columnar.columnar_form), which apply_lfs runs instead of the LF, and
+    the helpers it calls are part of the fingerprint.
+    """
+    seen = set() if seen is None else seen
+    if lf in seen:
+        return lf.__qualname__
+    seen.add(lf)
+    digest = hashlib.sha256()
+    columnar = getattr(lf, 'columnar', None)
+    if columnar is not None:
+        digest.update(lf_fingerprint(columnar, seen).encode('utf-8'))
+    if isinstance(lf, CompositeLF):
+        # Combined votes change with any of the deps
+        for dep in lf.deps:
+            digest.update(lf_fingerprint(dep, seen).encode('utf-8'))
+        lf = lf.combine
+    try:
+        digest.update(inspect.getsource(lf).encode('utf-8'))
+    except (OSError, TypeError):
+        digest.update(lf.__code__.co_code)
+    _update_with_globals(digest, lf, seen)
+    return digest.hexdigest()
+
+def report_key(doc):
+    """
+    sha256 digest of a report's text
+    """
+    text = doc if isinstance(doc, str) else as_doc(doc).text
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+def _as_key(key):
+    # Hex strings (e.g. the CSV hash column) or raw digests, as 32 bytes
+    if isinstance(key, str):
+        if HEX_DIGEST_RE.fullmatch(key):
+            return bytes.fromhex(key)
+        return hashlib.sha256(key.encode('utf-8')).digest()
+    return key
+
+class LabelCache(object):
+    """
+    On-disk cache of LF votes per (LF fingerprint, report key).
+
+    Report keys are sha256 digests of the report text by default, so a
+    report is only relabeled when its text changes; any other stable
+    per-report key (e.g. the CSV hash column) can be passed instead. Every
+    report seen is given a row id in reports.npy; each LF fingerprint
+    stores which rows it has been computed on plus its non-abstain votes
+    in <fingerprint>.npz. apply then only runs LFs whose fingerprint is
+    new on every document, and the other LFs on documents they have not
+    seen yet.
+
+    Files for fingerprints of edited LFs are left in place; delete the
+    cache directory to reclaim them. Only one process should write to a
+    cache directory at a time.
+    """
+
+    def __init__(self, cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        path = self._reports_path()
+        self.report_keys = np.load(path) if os.path.exists(path) else np.zeros(0, 'S32')
+        self._order = np.argsort(self.report_keys, kind='stable')
+
+    def _reports_path(self):
+        return os.path.join(self.cache_dir, 'reports.npy')
+
+    def _lf_path(self, fingerprint):
+        return os.path.join(self.cache_dir, f'{fingerprint}.npz')
+
+    def _save(self, path, save, *args, **kwargs):
+        # Write-then-rename so an interrupted run never leaves a torn file
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as fout:
+            save(fout, *args, **kwargs)
+        os.replace(tmp, path)
+
+    def _report_ids(self, keys):
+        """
+        Row ids of keys, registering keys not seen before
+        """
+        ids = np.full(len(keys), -1, dtype=np.int64)
+        if len(self.report_keys):
+            ordered = self.report_keys[self._order]
+            pos = np.minimum(np.searchsorted(ordered, keys), len(ordered) - 1)
+            found = ordered[pos] == keys
+            ids[found] = self._order[pos[found]]
+        new = ids == -1
+        if new.any():
+            new_keys, first, inverse = np.unique(keys[new], return_index=True, return_inverse=True)
+            # Number new reports in order of first appearance
+            rank = np.empty(len(first), dtype=np.int64)
+            rank[np.argsort(first, kind='stable')] = np.arange(len(first))
+            ids[new] = len(self.report_keys) + rank[inverse]
+            appended = np.empty(len(first), dtype='S32')
+            appended[rank] = new_keys
+            self.report_keys = np.concatenate([self.report_keys, appended])
+            self._order = np.argsort(self.report_keys, kind='stable')
+            self._save(self._reports_path(), np.save, self.report_keys)
+        return ids
+
+    def _load_lf(self, fingerprint):
+        """
+        (computed, vote_ids, votes) stored for fingerprint, with computed
+        covering every known report
+        """
+        n = len(self.report_keys)
+        path = self._lf_path(fingerprint)
+        if not os.path.exists(path):
+            return np.zeros(n, dtype=bool), np.zeros(0, np.int64), np.zeros(0, np.int8)
+        with np.load(path) as stored:
+            computed = np.unpackbits(stored['computed'])[:int(stored['n_reports'])].astype(bool)
+            vote_ids, votes = stored['vote_ids'], stored['votes']
+        return np.pad(computed, (0, n - len(computed)), 'constant'), vote_ids, votes
+
+    def _save_lf(self, fingerprint, computed, vote_ids, votes):
+        self._save(self._lf_path(fingerprint), np.savez, computed=np.packbits(computed),
+                   n_reports=len(computed), vote_ids=vote_ids, votes=votes)
+
+    def apply(self, lfs, docs, keys=None, n_workers=None, chunk_size=DEFAULT_CHUNK_SIZE, pool=None):
+        """
+        Same label matrix as apply_lfs(lfs, docs), computing only the
+        (LF, report) votes missing from the cache and storing them.
+        keys optionally gives one key per document (hex digest, bytes or
+        string) to use instead of the text digest. pool is passed on to
+        apply_lfs.
+        """
+        lfs = list(lfs)
+        docs = list(docs)
+        if keys is None:
+            keys = [report_key(doc) for doc in docs]
+        keys = np.array([_as_key(key) for key in keys], dtype='S32')
+        if len(keys) != len(docs):
+            raise ValueError(f'Got {len(keys)} keys for {len(docs)} documents')
+        ids = self._report_ids(keys)
+        fingerprints = [lf_fingerprint(lf) for lf in lfs]
+        stored = [self._load_lf(fingerprint) for fingerprint in fingerprints]
+
+        # Label every document missing from at least one LF, with only the
+        # LFs missing it
+        missing = [~computed[ids] for computed, _, _ in stored]
+        stale = [col for col, rows in enumerate(missing) if rows.any()]
+        if stale:
+            rows = np.flatnonzero(np.logical_or.reduce([missing[col] for col in stale]))
+            L_new = apply_lfs([lfs[col] for col in stale], [docs[row] for row in rows],
+                              n_workers=n_workers, chunk_size=chunk_size, pool=pool).tocsc()
+            for new_col, col in enumerate(stale):
+                computed, vote_ids, votes = stored[col]
+                column = L_new[:, new_col].toarray().ravel()
+                todo = missing[col][rows]
+                # Each report once, even if it occurs in several documents
+                new_ids, first = np.unique(ids[rows[todo]], return_index=True)
+                new_votes = column[todo][first]
+                voted = new_votes != 0
+                computed[new_ids] = True
+                vote_ids = np.concatenate([vote_ids, new_ids[voted]])
+                votes = np.concatenate([votes, new_votes[voted].astype(np.int8)])
+                stored[col] = (computed, vote_ids, votes)
+                self._save_lf(fingerprints[col], computed, vote_ids, votes)
+
+        # Gather each LF's votes for the requested documents
+        rows_out, cols_out, data_out = [], [], []
+        for col, (_, vote_ids, votes) in enumerate(stored):
+            by_report = np.zeros(len(self.report_keys), dtype=np.int8)
+            by_report[vote_ids] = votes
+            column = by_report[ids]
+            voted = np.flatnonzero(column)
+            rows_out.append(voted)
+            cols_out.append(np.full(len(voted), col, dtype=np.int64))
+            data_out.append(column[voted])
+        shape = (len(docs), len(lfs))
+        if not lfs:
+            return coo_matrix(shape, dtype=np.int8).tocsr()
+        return coo_matrix((np.concatenate(data_out), (np.concatenate(rows_out), np.concatenate(cols_out))),
+                          shape=shape, dtype=np.int8).tocsr()
+
+    def apply_to_splits(self, lfs, splits, keys=None, n_workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Cached counterpart of apply_lfs_to_splits; keys, if given, holds one
+        key list per split
+        """
+        splits = [list(docs) for docs in splits]
+        all_keys = None if keys is None else [key for split_keys in keys for key in split_keys]
+        L = self.apply(lfs, [doc for docs in splits for doc in docs], keys=all_keys,
+                       n_workers=n_workers, chunk_size=chunk_size)
+        Ls = []
+        start = 0
+        for docs in splits:
+            Ls.append(L[start:start + len(docs)])
+            start += len(docs)
+        return Ls
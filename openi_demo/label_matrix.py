@@ -0,0 +1,366 @@
+import multiprocessing
+import os
+import time
+from array import array
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+
+# Shared LF helpers live alongside the application LFs in ../lfs
+import lfs_path  # noqa: F401
+from columnar import release_corpus
+from composite import LFPlan, has_composites
+from docview import DocView
+from lf_profile import LFProfile, LFStats
+
+# Documents handed to each shard per task
+DEFAULT_CHUNK_SIZE = 256
+
+def default_n_workers():
+    """
+    Number of cores available to this process
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def as_view(doc):
+    """
+    Wraps raw report strings in a DocView so all LFs share its caches
+    """
+    return doc if isinstance(doc, DocView) or not isinstance(doc, str) else DocView(doc)
+
+class SparseVotes(object):
+    """
+    Non-abstain votes as COO triplets in compact typed buffers (int32 row
+    and column indices, int8 votes), so memory grows with the number of
+    votes cast rather than with documents x LFs
+    """
+
+    __slots__ = ('rows', 'cols', 'data')
+
+    def __init__(self):
+        self.rows = array('i')
+        self.cols = array('i')
+        self.data = array('b')
+
+    def __len__(self):
+        return len(self.data)
+
+    def extend(self, other):
+        self.rows.extend(other.rows)
+        self.cols.extend(other.cols)
+        self.data.extend(other.data)
+
+    def add_column(self, col, column):
+        """
+        Adds the non-abstain votes of a whole int8 vote column
+        """
+        rows = np.flatnonzero(column)
+        self.rows.frombytes(rows.astype(np.intc).tobytes())
+        self.cols.frombytes(np.full(len(rows), col, dtype=np.intc).tobytes())
+        self.data.frombytes(column[rows].astype(np.int8).tobytes())
+
+    def remap_columns(self, cols):
+        """
+        Renumbers column j as cols[j]
+        """
+        if self.cols:
+            mapped = np.asarray(cols, dtype=np.intc)[np.frombuffer(self.cols, dtype=np.intc)]
+            self.cols = array('i', mapped.tobytes())
+
+    def to_csr(self, shape):
+        """
+        Finalizes the votes into an int8 CSR label matrix
+        """
+        rows = np.frombuffer(self.rows, dtype=np.intc) if self.rows else np.zeros(0, np.intc)
+        cols = np.frombuffer(self.cols, dtype=np.intc) if self.cols else np.zeros(0, np.intc)
+        data = np.frombuffer(self.data, dtype=np.int8) if self.data else np.zeros(0, np.int8)
+        return coo_matrix((data, (rows, cols)), shape=shape, dtype=np.int8).tocsr()
+
+def prefetch_batch(lfs, docs):
+    """
+    Runs each distinct batch hook (an LF's prefetch attribute, e.g. batched
+    sentence segmentation) once on a chunk of documents
+    """
+    hooks = []
+    for lf in lfs:
+        hook = getattr(lf, 'prefetch', None)
+        if hook is not None and hook not in hooks:
+            hooks.append(hook)
+    for hook in hooks:
+        hook(docs)
+
+def evaluate_lfs_on_docs(lfs, docs, offset=0, profile=None):
+    """
+    Evaluates every lf on each document and returns the non-abstain votes,
+    numbering rows from offset. Composite LFs are evaluated through an
+    LFPlan, so LFs they depend on run once per document. If profile (an
+    LFProfile) is given, every LF call is timed into it.
+    """
+    votes = SparseVotes()
+    rows, cols, data = votes.rows, votes.cols, votes.data
+    docs = [as_view(doc) for doc in docs]
+    if profile is not None:
+        plan = LFPlan(lfs)
+        profile.reset(lf.__name__ for lf in plan.lfs)
+        profile.docs = profile.unique_docs = len(docs)
+        record_stats = [stats.record for stats in profile.stats]
+
+        def record(slot, seconds, vote):
+            record_stats[slot](seconds, vote)
+
+        prefetch_batch(plan.lfs, docs)
+        for row, doc in enumerate(docs, offset):
+            for col, vote in enumerate(plan.evaluate_timed(doc, record)):
+                if vote:
+                    rows.append(row)
+                    cols.append(col)
+                    data.append(vote)
+        return votes
+    if has_composites(lfs):
+        plan = LFPlan(lfs)
+        prefetch_batch(plan.lfs, docs)
+        for row, doc in enumerate(docs, offset):
+            for col, vote in enumerate(plan.evaluate(doc)):
+                if vote:
+                    rows.append(row)
+                    cols.append(col)
+                    data.append(vote)
+        return votes
+    prefetch_batch(lfs, docs)
+    for row, doc in enumerate(docs, offset):
+        for col, lf in enumerate(lfs):
+            vote = lf(doc)
+            if vote:
+                rows.append(row)
+                cols.append(col)
+                data.append(vote)
+    return votes
+
+# Per-worker state, set once by _init_worker
+_worker = {}
+
+def _init_worker(lfs, docs, profiled=False):
+    _worker['lfs'] = lfs
+    _worker['docs'] = docs
+    _worker['profiled'] = profiled
+
+def _label_shard(bounds):
+    start, stop = bounds
+    profile = LFProfile() if _worker['profiled'] else None
+    votes = evaluate_lfs_on_docs(_worker['lfs'], _worker['docs'][start:stop], start, profile)
+    return votes, profile
+
+def _label_docs(task):
+    # LabelingPool task: the documents travel with it
+    offset, docs, cols, profiled = task
+    profile = LFProfile() if profiled else None
+    lfs = [_worker['lfs'][col] for col in cols]
+    return evaluate_lfs_on_docs(lfs, docs, offset, profile), profile
+
+def _fork_context():
+    # Fork shares LFs and documents with the workers without pickling them
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('fork' if 'fork' in methods else None)
+
+class LabelingPool(object):
+    """
+    A pool of n_workers processes holding a suite of LFs, to be passed as
+    pool to several apply_lfs calls (e.g. one per chunk of a streamed
+    corpus) instead of starting a pool per call. Documents are sent to
+    the workers with each task, in tasks small enough to keep every
+    worker busy. Use as a context manager, or close it when done.
+    """
+
+    def __init__(self, lfs, n_workers=None):
+        self.lfs = list(lfs)
+        self.n_workers = default_n_workers() if n_workers is None else n_workers
+        self._cols = {lf: col for col, lf in enumerate(self.lfs)}
+        self._pool = _fork_context().Pool(self.n_workers, initializer=_init_worker,
+                                          initargs=(self.lfs, None))
+
+    def label(self, lfs, docs, chunk_size=DEFAULT_CHUNK_SIZE, profile=None):
+        """
+        Non-abstain votes of lfs (some of the pool's LFs) on docs
+        """
+        try:
+            cols = [self._cols[lf] for lf in lfs]
+        except KeyError as e:
+            raise ValueError(f'{e.args[0].__name__} is not an LF of this LabelingPool')
+        chunk_size = max(min(chunk_size, -(-len(docs) // self.n_workers)), 1)
+        tasks = [(start, docs[start:start + chunk_size], cols, profile is not None)
+                 for start in range(0, len(docs), chunk_size)]
+        votes = SparseVotes()
+        for task_votes, task_profile in self._pool.imap_unordered(_label_docs, tasks):
+            votes.extend(task_votes)
+            if profile is not None:
+                profile.merge(task_profile)
+        return votes
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._pool.terminate()
+        self._pool.join()
+
+def report_texts(docs):
+    """
+    The report texts of docs, or None if some document is neither a
+    string nor a DocView
+    """
+    texts = []
+    for doc in docs:
+        if isinstance(doc, DocView):
+            texts.append(doc.text)
+        elif isinstance(doc, str):
+            texts.append(doc)
+        else:
+            return None
+    return texts
+
+def unique_reports(texts):
+    """
+    (first, inverse) for deduplicating the report texts: texts[first] are
+    the distinct texts in order of first occurrence and
+    texts[first][inverse] == texts
+    """
+    inverse, _ = pd.factorize(pd.Series(texts, dtype=object))
+    # factorize numbers texts in order of first occurrence
+    _, first = np.unique(inverse, return_index=True)
+    return first, inverse
+
+def evaluate_columnar(lfs, texts, profile=None):
+    """
+    Votes of LFs with a columnar form (lf.columnar, taking a pd.Series of
+    report texts and returning one vote per report) on texts
+    """
+    votes = SparseVotes()
+    try:
+        for col, lf in enumerate(lfs):
+            start = time.perf_counter()
+            column = np.asarray(lf.columnar(texts), dtype=np.int8)
+            seconds = time.perf_counter() - start
+            votes.add_column(col, column)
+            if profile is not None:
+                stats = LFStats()
+                stats.record_batch(seconds, column)
+                profile.add(lf.__name__, stats)
+    finally:
+        # The corpus the LFs shared is only valid for texts
+        release_corpus()
+    return votes
+
+def apply_lfs(lfs, docs, n_workers=None, chunk_size=DEFAULT_CHUNK_SIZE, profile=None, dedup=True,
+              pool=None):
+    """
+    Creates the (documents x lfs) label matrix.
+
+    With dedup, byte-identical report texts (boilerplate normal reports
+    are common) are labeled once and their votes copied to every row
+    holding them. LFs with a columnar form (see evaluate_columnar) are applied to all
+    report texts at once with vectorized kernels. The others are applied
+    per document: documents, not LFs, are sharded across a pool of
+    n_workers processes (default: all available cores); each worker
+    evaluates every LF on its documents and streams the non-abstain votes
+    into int8 COO buffers, which are finalized into an int8 CSR matrix
+    without ever building a dense one. Raw report strings are wrapped in
+    one DocView per document, so every LF shares its preprocessing.
+
+    Pass an LFProfile as profile to record per-LF timings and votes,
+    merged across workers, and the number of distinct reports labeled.
+    Pass a LabelingPool as pool to label with its workers instead of
+    starting n_workers new ones.
+    """
+    lfs = list(lfs)
+    docs = list(docs)
+    n_docs = len(docs)
+    columnar = [col for col, lf in enumerate(lfs) if getattr(lf, 'columnar', None) is not None]
+    texts = report_texts(docs) if dedup or columnar else None
+
+    inverse = None
+    if dedup and texts is not None:
+        first, inverse = unique_reports(texts)
+        if len(first) < n_docs:
+            docs = [docs[row] for row in first]
+            texts = [texts[row] for row in first]
+        else:
+            inverse = None
+
+    if texts is None:
+        columnar = []
+    scalar = sorted(set(range(len(lfs))) - set(columnar))
+    run_profile = None if profile is None else LFProfile()
+
+    votes = SparseVotes()
+    if scalar:
+        votes = apply_scalar_lfs([lfs[col] for col in scalar], docs, n_workers, chunk_size, run_profile,
+                                 pool)
+        votes.remap_columns(scalar)
+    if columnar:
+        columnar_votes = evaluate_columnar([lfs[col] for col in columnar],
+                                           pd.Series(texts, dtype=object), run_profile)
+        columnar_votes.remap_columns(columnar)
+        votes.extend(columnar_votes)
+    if profile is not None:
+        run_profile.docs = n_docs
+        run_profile.unique_docs = len(docs)
+        profile.merge(run_profile)
+
+    L = votes.to_csr((len(docs), len(lfs)))
+    if inverse is not None:
+        # Scatter the votes of each distinct report back to its rows
+        L = L[inverse]
+    return L
+
+def apply_scalar_lfs(lfs, docs, n_workers=None, chunk_size=DEFAULT_CHUNK_SIZE, profile=None, pool=None):
+    """
+    Non-abstain votes of lfs called on each document, sharded across
+    n_workers processes or the workers of a LabelingPool
+    """
+    if pool is not None:
+        return pool.label(lfs, docs, chunk_size, profile)
+    if n_workers is None:
+        n_workers = default_n_workers()
+    n_workers = min(n_workers, -(-len(docs) // chunk_size))
+
+    if n_workers <= 1:
+        shard_profile = None if profile is None else LFProfile()
+        votes = evaluate_lfs_on_docs(lfs, docs, profile=shard_profile)
+        if profile is not None:
+            profile.merge(shard_profile)
+        return votes
+
+    context = _fork_context()
+    shards = [(start, min(start + chunk_size, len(docs)))
+              for start in range(0, len(docs), chunk_size)]
+    votes = SparseVotes()
+    initargs = (lfs, docs, profile is not None)
+    with context.Pool(n_workers, initializer=_init_worker, initargs=initargs) as pool:
+        for shard_votes, shard_profile in pool.imap_unordered(_label_shard, shards):
+            votes.extend(shard_votes)
+            if profile is not None:
+                profile.merge(shard_profile)
+    return votes
+
+def apply_lfs_to_splits(lfs, splits, n_workers=None, chunk_size=DEFAULT_CHUNK_SIZE, profile=None):
+    """
+    Labels several splits (e.g. train/dev/test document lists) in a single
+    run and returns one label matrix per split, in the same order
+    """
+    splits = [list(docs) for docs in splits]
+    L = apply_lfs(lfs, [doc for docs in splits for doc in docs],
+                  n_workers=n_workers, chunk_size=chunk_size, profile=profile)
+    Ls = []
+    start = 0
+    for docs in splits:
+        Ls.append(L[start:start + len(docs)])
+        start += len(docs)
+    return Ls
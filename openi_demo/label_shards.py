@@ -0,0 +1,148 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, load_npz, save_npz, vstack
+
+from label_cache import LabelCache
+from label_matrix import DEFAULT_CHUNK_SIZE, LabelingPool, apply_lfs, default_n_workers
+
+# Reports read, labeled and written per shard
+DEFAULT_ROWS_PER_SHARD = 10000
+
+INDEX_FILE = 'index.json'
+
+def iter_csv_chunks(csv_path, rows_per_shard=DEFAULT_ROWS_PER_SHARD, columns=('text',)):
+    """
+    Yields the requested columns of a report CSV as DataFrames of at most
+    rows_per_shard rows, never holding more than one chunk in memory
+    """
+    for chunk in pd.read_csv(csv_path, usecols=list(columns), chunksize=rows_per_shard):
+        yield chunk
+
+def _write_index(out_dir, index):
+    tmp = os.path.join(out_dir, INDEX_FILE + '.tmp')
+    with open(tmp, 'w') as fout:
+        json.dump(index, fout, indent=1)
+    os.replace(tmp, os.path.join(out_dir, INDEX_FILE))
+
+def stream_label_matrix(lfs, csv_path, out_dir, rows_per_shard=DEFAULT_ROWS_PER_SHARD,
+                        text_column='text', label_column=None, key_column=None,
+                        cache_dir=None, n_workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Labels a report CSV of any size chunk by chunk, writing one int8 CSR
+    label matrix shard (.npz) per chunk to out_dir plus an index.json
+    describing the shards. Memory is bounded by one chunk of reports and
+    its label matrix.
+
+    If label_column is given, that column is saved alongside each shard.
+    If cache_dir is given, votes are cached there with one LabelCache per
+    shard (keyed by key_column when given and by report text otherwise),
+    so a rerun with the same rows_per_shard only recomputes edited LFs
+    while memory and cache I/O stay bounded by one chunk.
+    With n_workers > 1, one LabelingPool of n_workers processes labels
+    every chunk.
+
+    Returns a LabelMatrixShards over the written shards.
+    """
+    lfs = list(lfs)
+    os.makedirs(out_dir, exist_ok=True)
+    columns = [text_column] + [c for c in (label_column, key_column) if c is not None]
+    index = {
+        'source': os.path.abspath(csv_path),
+        'lf_names': [lf.__name__ for lf in lfs],
+        'n_rows': 0,
+        'shards': [],
+    }
+    if n_workers is None:
+        n_workers = default_n_workers()
+    # One pool of workers labels every chunk
+    pool = LabelingPool(lfs, n_workers) if n_workers > 1 else None
+    try:
+        for shard_id, chunk in enumerate(iter_csv_chunks(csv_path, rows_per_shard, columns)):
+            docs = chunk[text_column].fillna('').tolist()
+            shard = {'matrix': f'shard_{shard_id:05d}.npz', 'start': index['n_rows'], 'n_rows': len(docs)}
+            if cache_dir is None:
+                L = apply_lfs(lfs, docs, n_workers=n_workers, chunk_size=chunk_size,
+                              pool=pool)
+            else:
+                cache = LabelCache(os.path.join(cache_dir, f'shard_{shard_id:05d}'))
+                keys = None if key_column is None else chunk[key_column].tolist()
+                L = cache.apply(lfs, docs, keys=keys, n_workers=n_workers,
+                                chunk_size=chunk_size, pool=pool)
+            save_npz(os.path.join(out_dir, shard['matrix']), L)
+            if label_column is not None:
+                shard['labels'] = f'labels_{shard_id:05d}.npy'
+                np.save(os.path.join(out_dir, shard['labels']), chunk[label_column].values)
+            index['shards'].append(shard)
+            index['n_rows'] += len(docs)
+            # Rewritten after every shard so a partial run is still loadable
+            _write_index(out_dir, index)
+    finally:
+        if pool is not None:
+            pool.close()
+    if not index['shards']:
+        _write_index(out_dir, index)
+    return LabelMatrixShards(out_dir)
+
+class LabelMatrixShards(object):
+    """
+    Lazy view of the label matrix shards written by stream_label_matrix.
+    Shards are only read from disk when indexed or iterated over;
+    to_csr concatenates them into a single label matrix.
+    """
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        with open(os.path.join(out_dir, INDEX_FILE)) as fin:
+            self.index = json.load(fin)
+
+    @property
+    def lf_names(self):
+        return self.index['lf_names']
+
+    @property
+    def shape(self):
+        return (self.index['n_rows'], len(self.lf_names))
+
+    def __len__(self):
+        return len(self.index['shards'])
+
+    def __getitem__(self, idx):
+        """
+        Label matrix of shard idx
+        """
+        return load_npz(os.path.join(self.out_dir, self.index['shards'][idx]['matrix'])).tocsr()
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def labels(self, idx):
+        """
+        Labels saved with shard idx, or None if none were saved
+        """
+        name = self.index['shards'][idx].get('labels')
+        return None if name is None else np.load(os.path.join(self.out_dir, name), allow_pickle=True)
+
+    def iter_with_labels(self):
+        """
+        Yields (label matrix, labels) per shard
+        """
+        for idx in range(len(self)):
+            yield self[idx], self.labels(idx)
+
+    def to_csr(self):
+        """
+        Concatenates every shard into one int8 CSR label matrix
+        """
+        if not len(self):
+            return csr_matrix(self.shape, dtype=np.int8)
+        return vstack(list(self), format='csr', dtype=np.int8)
+
+    def all_labels(self):
+        """
+        Concatenated labels of every shard
+        """
+        return np.concatenate([self.labels(idx) for idx in range(len(self))])
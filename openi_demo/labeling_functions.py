@@ -1,34 +1,59 @@
 import re
 
+# Shared LF helpers live alongside the application LFs in ../lfs
+import lfs_path  # noqa: F401
+from columnar import columnar_form, contains, lengths, votes_where
+from docview import as_doc
+from keyword_matcher import KeywordMatcher
+from negation import NegationWindow
+from patterns import EQUIVOCATION, compile_pattern
+
 # Defining labels
 ABSTAIN = 0
 ABNORMAL = 1
 NORMAL= 2
 
+# Keyword lists of the substring LFs, matched in one pass over the lowercased report
+report_keywords = KeywordMatcher(lower=True)
+
 def LF_report_is_short(report):
     """
     Checks if report is short.
     """
     return NORMAL if len(report) < 280 else ABSTAIN
 
+@columnar_form(LF_report_is_short)
+def report_is_short_columnar(reports):
+    return votes_where(lengths(reports) < 280, NORMAL)
+
 negative_inflection_words = ["but", "however", "otherwise"]
+kw_negative_inflection = report_keywords.add(negative_inflection_words)
 def LF_negative_inflection_words_in_report(report):
-    return ABNORMAL if any(word in report.lower() \
-                      for word in negative_inflection_words) else ABSTAIN
+    return ABNORMAL if report_keywords.hits(report) & kw_negative_inflection else ABSTAIN
 
+kw_seen_or_noted = report_keywords.add(["is seen", "noted"])
 def LF_is_seen_or_noted_in_report(report):
-    return ABNORMAL if any(word in report.lower() \
-                      for word in ["is seen", "noted"]) else ABSTAIN
+    return ABNORMAL if report_keywords.hits(report) & kw_seen_or_noted else ABSTAIN
 
+kw_disease = report_keywords.add(["disease"])
 def LF_disease_in_report(report):
-    return ABNORMAL if "disease" in report.lower() else ABSTAIN
+    return ABNORMAL if report_keywords.hits(report) & kw_disease else ABSTAIN
 
+@columnar_form(LF_disease_in_report)
+def disease_in_report_columnar(reports):
+    return votes_where(contains(reports, 'disease', lower=True), ABNORMAL)
+
+kw_recommend = report_keywords.add(["recommend"])
 def LF_recommend_in_report(report):
-    return ABNORMAL if "recommend" in report.lower() else ABSTAIN
+    return ABNORMAL if report_keywords.hits(report) & kw_recommend else ABSTAIN
+
+@columnar_form(LF_recommend_in_report)
+def recommend_in_report_columnar(reports):
+    return votes_where(contains(reports, 'recommend', lower=True), ABNORMAL)
 
+kw_mm = report_keywords.add(["mm", "cm"])
 def LF_mm_in_report(report):
-    return ABNORMAL if any(word in report.lower() \
-                      for word in ["mm", "cm"]) else ABSTAIN
+    return ABNORMAL if report_keywords.hits(report) & kw_mm else ABSTAIN
 
 abnormal_mesh_terms = ["opacity", "cardiomegaly", "calcinosis",
                        "hypoinflation", "calcified granuloma",
@@ -36,8 +61,9 @@ abnormal_mesh_terms = ["opacity", "cardiomegaly", "calcinosis",
                        "hyperdistention", "catheters",
                        "granulomatous", "nodule", "fracture"
                        "surgical", "instruments", "emphysema"]
+kw_abnormal_mesh_terms = report_keywords.add(abnormal_mesh_terms)
 def LF_abnormal_mesh_terms_in_report(report):
-    if any(mesh in report.lower() for mesh in abnormal_mesh_terms):
+    if report_keywords.hits(report) & kw_abnormal_mesh_terms:
         return ABNORMAL
     else:
         return ABSTAIN
@@ -49,14 +75,11 @@ def LF_consistency_in_report(report):
     The words 'clear', 'no', 'normal', 'free', 'midline' in
     findings section of the report
     '''
-    report = report
-    findings = report[report.find('FINDINGS:'):]
-    findings = findings[:findings.find('IMPRESSION:')]
+    findings = as_doc(report).section_lower('FINDINGS:', 'IMPRESSION:')
     sents = findings.split('.')
 
     num_sents_without_normal = ABSTAIN
     for sent in sents:
-        sent = sent.lower()
         if not any(word in sent for word in words_indicating_normalcy):
             num_sents_without_normal += 1
         elif 'not' in sent:
@@ -70,81 +93,93 @@ categories = ['normal','opacity','cardiomegaly','calcinosis',
               'granulomatous disease','nodule','surgical instruments',
               'scoliosis', 'osteophyte', 'spondylosis','fractures, bone']
 
+reg_equivocation = compile_pattern(EQUIVOCATION,re.IGNORECASE)
+reg_no_acute = compile_pattern('No acute cardiopulmonary abnormality',re.IGNORECASE)
+reg_categories_pos = [compile_pattern(cat,re.IGNORECASE) for cat in categories]
+neg_categories = [NegationWindow(cat) for cat in categories]
+reg_fracture = compile_pattern('fracture',re.IGNORECASE)
+neg_fracture = NegationWindow('fracture')
+reg_calc = compile_pattern('calc',re.IGNORECASE)
+reg_calc_site = compile_pattern('arter|aorta|muscle|tissue',re.IGNORECASE)
+reg_degen = compile_pattern('degen',re.IGNORECASE)
+reg_spine = compile_pattern('spine',re.IGNORECASE)
+reg_hypoinflation = compile_pattern('hypoinflation|collapse|(low|decrease|diminish)\\s([a-zA-Z0-9\-,_]*\\s){0,4}volume',re.IGNORECASE)
+reg_hyperdistention = compile_pattern('increased volume|hyperexpan|inflated',re.IGNORECASE)
+reg_catheters = compile_pattern(' line|catheter|PICC',re.IGNORECASE)
+reg_clip = compile_pattern('clip',re.IGNORECASE)
+reg_granuloma = compile_pattern('granuloma',re.IGNORECASE)
+
 def LF_normal(report):
-    r = re.compile('No acute cardiopulmonary abnormality',re.IGNORECASE)
-    for s in report.split("."):
-        if r.search(s):
+    for s in as_doc(report).sentences:
+        if reg_no_acute.search(s):
             return NORMAL
     return ABSTAIN
 
-reg_equivocation = re.compile('unlikely|likely|suggests|questionable|concerning|possibly|potentially|could represent|may represent|may relate|cannot exclude|can\'t exclude|may be',re.IGNORECASE)
-
 def LF_positive_MeshTerm(report):
     for idx in range(1,len(categories)):
-        reg_pos = re.compile(categories[idx],re.IGNORECASE)
-        reg_neg = re.compile('(No|without|resolution)\\s([a-zA-Z0-9\-,_]*\\s){0,10}'+categories[idx],re.IGNORECASE)
-        for s in report.split("."):
-            if reg_pos.search(s) and (not reg_neg.search(s)) and (not reg_equivocation.search(s)):
+        reg_pos = reg_categories_pos[idx]
+        neg = neg_categories[idx]
+        for s in as_doc(report).sentences:
+            if reg_pos.search(s) and (not neg.search(s)) and (not reg_equivocation.search(s)):
                 return ABNORMAL
     return ABSTAIN
 
 def LF_fracture(report):
-    reg_pos = re.compile('fracture',re.IGNORECASE)
-    reg_neg = re.compile('(No|without|resolution)\\s([a-zA-Z0-9\-,_]*\\s){0,10}fracture',re.IGNORECASE)
-    for s in report.split("."):
-        if reg_pos.search(s) and (not reg_neg.search(s)) and (not reg_equivocation.search(s)):
+    for s in as_doc(report).sentences:
+        if reg_fracture.search(s) and (not neg_fracture.search(s)) and (not reg_equivocation.search(s)):
             return ABNORMAL
     return ABSTAIN
 
 def LF_calcinosis(report):
-    reg_01 = re.compile('calc',re.IGNORECASE)
-    reg_02 = re.compile('arter|aorta|muscle|tissue',re.IGNORECASE)
-    for s in report.split("."):
-        if reg_01.search(s) and reg_02.search(s):
+    for s in as_doc(report).sentences:
+        if reg_calc.search(s) and reg_calc_site.search(s):
             return ABNORMAL
     return ABSTAIN
 
 def LF_degen_spine(report):
-    reg_01 = re.compile('degen',re.IGNORECASE)
-    reg_02 = re.compile('spine',re.IGNORECASE)
-    for s in report.split("."):
-        if reg_01.search(s) and reg_02.search(s):
+    for s in as_doc(report).sentences:
+        if reg_degen.search(s) and reg_spine.search(s):
             return ABNORMAL
     return ABSTAIN
 
 def LF_lung_hypoinflation(report):
     #reg_01 = re.compile('lung|pulmonary',re.IGNORECASE)
-    reg_01 = re.compile('hypoinflation|collapse|(low|decrease|diminish)\\s([a-zA-Z0-9\-,_]*\\s){0,4}volume',re.IGNORECASE)
-    for s in report.split("."):
-        if reg_01.search(s):
+    for s in as_doc(report).sentences:
+        if reg_hypoinflation.search(s):
             return ABNORMAL
     return ABSTAIN
 
 def LF_lung_hyperdistention(report):
     #reg_01 = re.compile('lung|pulmonary',re.IGNORECASE)
-    reg_01 = re.compile('increased volume|hyperexpan|inflated',re.IGNORECASE)
-    for s in report.split("."):
-        if reg_01.search(s):
+    for s in as_doc(report).sentences:
+        if reg_hyperdistention.search(s):
             return ABNORMAL
     return ABSTAIN
 
 def LF_catheters(report):
-    reg_01 = re.compile(' line|catheter|PICC',re.IGNORECASE)
-    for s in report.split("."):
-        if reg_01.search(s):
+    for s in as_doc(report).sentences:
+        if reg_catheters.search(s):
             return ABNORMAL
     return ABSTAIN
 
+# reg_catheters and reg_granuloma cannot match across a period, so
+# searching whole reports is the same as searching each sentence
+@columnar_form(LF_catheters)
+def catheters_columnar(reports):
+    return votes_where(contains(reports, reg_catheters), ABNORMAL)
+
 def LF_surgical(report):
-    reg_01 = re.compile('clip',re.IGNORECASE)
-    for s in report.split("."):
-        if reg_01.search(s):
+    for s in as_doc(report).sentences:
+        if reg_clip.search(s):
             return ABNORMAL
     return ABSTAIN
 
 def LF_granuloma(report):
-    reg_01 = re.compile('granuloma',re.IGNORECASE)
-    for s in report.split("."):
-        if reg_01.search(s):
+    for s in as_doc(report).sentences:
+        if reg_granuloma.search(s):
             return ABNORMAL
-    return ABSTAIN
\ No newline at end of file
+    return ABSTAIN
+
+@columnar_form(LF_granuloma)
+def granuloma_columnar(reports):
+    return votes_where(contains(reports, reg_granuloma), ABNORMAL)
@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import pickle
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from label_matrix import evaluate_lfs_on_docs
+from lf_profile import LFStats
+
+# Requests coalesced into one batch at most
+DEFAULT_MAX_BATCH_SIZE = 64
+
+# Longest a request waits for others to join its batch
+DEFAULT_MAX_WAIT_MS = 5.0
+
+# Recent span over which /stats reports the current throughput
+THROUGHPUT_WINDOW_SECONDS = 10.0
+
+######################################################################################################
+##### LOADING
+######################################################################################################
+
+def load_lf_suite(path, lf_names=None):
+    """
+    LFs of the module at path: those named in lf_names, in that order
+    (e.g. the column order a label model was trained on), else every
+    function named LF_* in definition order
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if lf_names:
+        return [getattr(module, lf_name) for lf_name in lf_names]
+    return [value for key, value in vars(module).items()
+            if key.startswith('LF_') and callable(value)]
+
+def load_label_model(path):
+    """
+    A trained label model with predict_proba (e.g. metal's LabelModel),
+    pickled or saved with torch.save
+    """
+    try:
+        with open(path, 'rb') as fin:
+            return pickle.load(fin)
+    except pickle.UnpicklingError:
+        import torch
+        return torch.load(path)
+
+######################################################################################################
+##### MICRO-BATCHING LABELER
+######################################################################################################
+
+class ServiceStats(object):
+    """
+    Request latency histogram plus throughput and batching counters.
+    docs_per_second covers the batches that ended in the last
+    THROUGHPUT_WINDOW_SECONDS, over the span from the first of them
+    starting to the last ending, so idle time before and after them does
+    not dilute it; busy_docs_per_second is over the time spent labeling.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.latency = LFStats()
+        self.batches = 0
+        self.batch_seconds = 0.0
+        # (start time, end time, size) of the batches labeled within the window
+        self._recent = deque()
+
+    def record_batch(self, start, done, latencies):
+        """
+        Records a batch labeled from start to done and the latency of each
+        of its requests
+        """
+        self.batches += 1
+        self.batch_seconds += done - start
+        for seconds in latencies:
+            self.latency.record(seconds, None)
+        self._recent.append((start, done, len(latencies)))
+
+    def as_dict(self):
+        now = time.perf_counter()
+        uptime = now - self.started
+        while self._recent and self._recent[0][1] < now - THROUGHPUT_WINDOW_SECONDS:
+            self._recent.popleft()
+        span = self._recent[-1][1] - self._recent[0][0] if self._recent else 0.0
+        docs = self.latency.calls
+        return {
+            'uptime_seconds': uptime,
+            'docs': docs,
+            'batches': self.batches,
+            'mean_batch_size': docs / self.batches if self.batches else 0.0,
+            'docs_per_second': sum(size for _, _, size in self._recent) / span if span else 0.0,
+            'busy_docs_per_second': docs / self.batch_seconds if self.batch_seconds else 0.0,
+            'labeling_seconds': self.batch_seconds,
+            'latency_mean_ms': 1e3 * self.latency.seconds / docs if docs else 0.0,
+            'latency_p50_ms': 1e3 * self.latency.quantile(0.5),
+            'latency_p99_ms': 1e3 * self.latency.quantile(0.99),
+        }
+
+
+class MicroBatchLabeler(object):
+    """
+    Labels single reports by coalescing concurrent requests: a request
+    waits at most max_wait_ms for others to join its batch (up to
+    max_batch_size reports), then the whole batch is labeled at once on a
+    worker thread, keeping the event loop free to accept requests
+    """
+
+    def __init__(self, lfs, label_model=None, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.lfs = list(lfs)
+        self.lf_names = [lf.__name__ for lf in self.lfs]
+        self.label_model = label_model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1e3
+        self.stats = ServiceStats()
+        self._queue = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def label_batch(self, texts):
+        """
+        (votes, probabilities) rows for texts; probabilities are None
+        without a label model
+        """
+        shape = (len(texts), len(self.lfs))
+        L = evaluate_lfs_on_docs(self.lfs, texts).to_csr(shape)
+        probabilities = None
+        if self.label_model is not None:
+            probabilities = np.asarray(self.label_model.predict_proba(L)).tolist()
+        return L.toarray().tolist(), probabilities
+
+    async def label(self, text):
+        """
+        Votes and probabilistic label of one report
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, time.perf_counter(), future))
+        return await future
+
+    async def run(self):
+        """
+        Batching loop; runs until cancelled
+        """
+        self._queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = batch[0][1] + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            texts = [text for text, _, _ in batch]
+            start = time.perf_counter()
+            try:
+                votes, probabilities = await loop.run_in_executor(self._executor, self.label_batch, texts)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            done = time.perf_counter()
+            self.stats.record_batch(start, done, [done - arrived for _, arrived, _ in batch])
+            for idx, (_, _, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result({
+                        'votes': votes[idx],
+                        'probabilities': None if probabilities is None else probabilities[idx],
+                    })
+
+######################################################################################################
+##### HTTP
+######################################################################################################
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           500: 'Internal Server Error'}
+
+async def read_request(reader):
+    """
+    (method, path, headers, body) of the next HTTP/1.1 request, or None
+    when the client closed the connection
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    method, path, _ = line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, _, value = line.decode('latin-1').partition(':')
+        headers[key.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    body = await reader.readexactly(length) if length else b''
+    return method, path, headers, body
+
+def write_response(writer, status, payload, keep_alive=True):
+    body = json.dumps(payload).encode('utf-8')
+    head = (f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+            f'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+    writer.write(head.encode('latin-1') + body)
+
+class LabelingService(object):
+    """
+    HTTP front end of a MicroBatchLabeler:
+
+        POST /label  {"text": "..."}   -> {"votes": [...], "probabilities": [...]}
+        GET  /lfs                      -> LF names, in vote order
+        GET  /stats                    -> latency and throughput counters
+    """
+
+    def __init__(self, labeler):
+        self.labeler = labeler
+
+    async def handle(self, method, path, body):
+        if path == '/label':
+            if method != 'POST':
+                return 405, {'error': 'POST a JSON body {"text": ...}'}
+            try:
+                text = json.loads(body.decode('utf-8'))['text']
+            except (ValueError, KeyError, TypeError):
+                return 400, {'error': 'expected a JSON body {"text": ...}'}
+            if not isinstance(text, str):
+                return 400, {'error': 'text must be a string'}
+            return 200, await self.labeler.label(text)
+        if path == '/stats':
+            return 200, self.labeler.stats.as_dict()
+        if path == '/lfs':
+            return 200, {'lfs': self.labeler.lf_names}
+        return 404, {'error': f'no route {path}'}
+
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                try:
+                    status, payload = await self.handle(method, path, body)
+                except Exception as e:
+                    status, payload = 500, {'error': repr(e)}
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+async def serve(labeler, host='127.0.0.1', port=8000):
+    service = LabelingService(labeler)
+    batcher = asyncio.ensure_future(labeler.run())
+    server = await asyncio.start_server(service.serve_connection, host, port)
+    print(f'Labeling with {len(labeler.lfs)} LFs on http://{host}:{port}')
+    try:
+        # Serve until the process is interrupted
+        await asyncio.get_running_loop().create_future()
+    finally:
+        batcher.cancel()
+        server.close()
+
+if __name__ == '__main__':
+    default_lfs = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'labeling_functions.py')
+    parser = argparse.ArgumentParser(description='Micro-batching LF labeling service')
+    parser.add_argument('--lfs', default=default_lfs, help='LF module, e.g. ../lfs/lfs_cxr.py')
+    parser.add_argument('--lf-names', help='comma-separated LF names, in label model column order')
+    parser.add_argument('--label-model', help='pickled or torch-saved trained label model')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch-size', type=int, default=DEFAULT_MAX_BATCH_SIZE)
+    parser.add_argument('--max-wait-ms', type=float, default=DEFAULT_MAX_WAIT_MS,
+                        help='latency budget for coalescing requests into a batch')
+    args = parser.parse_args()
+
+    lfs = load_lf_suite(args.lfs, args.lf_names.split(',') if args.lf_names else None)
+    label_model = load_label_model(args.label_model) if args.label_model else None
+    labeler = MicroBatchLabeler(lfs, label_model, args.max_batch_size, args.max_wait_ms)
+    try:
+        asyncio.run(serve(labeler, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
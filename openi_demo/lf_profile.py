@@ -0,0 +1,179 @@
+import json
+import math
+
+import numpy as np
+
+# Latency histogram buckets per doubling of time
+SUB_BUCKETS = 4
+
+def _bucket(seconds):
+    """
+    Log-scale histogram bucket of a latency
+    """
+    if seconds <= 0:
+        return None
+    mantissa, exponent = math.frexp(seconds)
+    return exponent * SUB_BUCKETS + int((mantissa - 0.5) * 2 * SUB_BUCKETS)
+
+def _bucket_seconds(bucket):
+    """
+    Geometric midpoint of a histogram bucket
+    """
+    exponent, sub = divmod(bucket, SUB_BUCKETS)
+    lo = math.ldexp(0.5 + sub / (2 * SUB_BUCKETS), exponent)
+    hi = math.ldexp(0.5 + (sub + 1) / (2 * SUB_BUCKETS), exponent)
+    return math.sqrt(lo * hi)
+
+
+class LFStats(object):
+    """
+    Call count, total wall time, vote counts and a log-bucket latency
+    histogram of one LF
+    """
+
+    __slots__ = ('calls', 'seconds', 'votes', 'histogram')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.votes = {}
+        self.histogram = {}
+
+    def record(self, seconds, vote):
+        self.calls += 1
+        self.seconds += seconds
+        self.votes[vote] = self.votes.get(vote, 0) + 1
+        bucket = _bucket(seconds)
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    def record_batch(self, seconds, votes):
+        """
+        Records one vectorized call over len(votes) documents, spreading
+        its time evenly over them
+        """
+        n = len(votes)
+        if not n:
+            return
+        self.calls += n
+        self.seconds += seconds
+        values, counts = np.unique(votes, return_counts=True)
+        for vote, count in zip(values.tolist(), counts.tolist()):
+            self.votes[vote] = self.votes.get(vote, 0) + count
+        bucket = _bucket(seconds / n)
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + n
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.seconds += other.seconds
+        for vote, count in other.votes.items():
+            self.votes[vote] = self.votes.get(vote, 0) + count
+        for bucket, count in other.histogram.items():
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + count
+
+    def quantile(self, q):
+        """
+        Approximate per-call latency quantile, within a bucket's width
+        (about 19%)
+        """
+        if not self.calls:
+            return 0.0
+        target = q * self.calls
+        seen = 0
+        # Calls too fast for the timer sort first
+        for bucket in sorted(self.histogram, key=lambda b: -math.inf if b is None else b):
+            seen += self.histogram[bucket]
+            if seen >= target:
+                return 0.0 if bucket is None else _bucket_seconds(bucket)
+        return 0.0
+
+
+class LFProfile(object):
+    """
+    Per-LF instrumentation of a label matrix build: pass one to apply_lfs
+    (profile=...) and it is filled with the stats of every LF, merged
+    across worker processes. Without a profile, apply_lfs runs its
+    uninstrumented loop.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.stats = []
+        self.docs = 0
+        self.unique_docs = 0
+
+    def reset(self, names):
+        self.names = list(names)
+        self.stats = [LFStats() for _ in self.names]
+        self.docs = 0
+        self.unique_docs = 0
+
+    @property
+    def dedup_ratio(self):
+        """
+        Share of the documents that were duplicates of an earlier one
+        """
+        return 1.0 - self.unique_docs / self.docs if self.docs else 0.0
+
+    def add(self, name, stats):
+        """
+        Adds the stats of an LF evaluated outside the per-document loop
+        """
+        self.names.append(name)
+        self.stats.append(stats)
+
+    def merge(self, other):
+        if not self.names:
+            self.reset(other.names)
+        if other.names != self.names:
+            raise ValueError('Cannot merge profiles of different LFs')
+        for stats, other_stats in zip(self.stats, other.stats):
+            stats.merge(other_stats)
+        self.docs += other.docs
+        self.unique_docs += other.unique_docs
+
+    def rows(self):
+        """
+        One dict of stats per LF, slowest first
+        """
+        total = sum(stats.seconds for stats in self.stats) or 1.0
+        rows = []
+        for name, stats in zip(self.names, self.stats):
+            rows.append({
+                'lf': name,
+                'calls': stats.calls,
+                'seconds': stats.seconds,
+                'share': stats.seconds / total,
+                'mean_us': 1e6 * stats.seconds / stats.calls if stats.calls else 0.0,
+                'p50_us': 1e6 * stats.quantile(0.5),
+                'p99_us': 1e6 * stats.quantile(0.99),
+                'votes': {str(vote): count for vote, count in sorted(stats.votes.items())},
+            })
+        return sorted(rows, key=lambda row: row['seconds'], reverse=True)
+
+    def table(self):
+        """
+        The stats as a fixed-width text table
+        """
+        lines = [f'{self.docs} docs, {self.unique_docs} unique ({self.dedup_ratio:.1%} duplicates)',
+                 f'{"lf":<40}{"calls":>9}{"total s":>10}{"share":>8}{"mean us":>10}'
+                 f'{"p50 us":>10}{"p99 us":>10}  votes']
+        for row in self.rows():
+            votes = ' '.join(f'{vote}:{count}' for vote, count in row['votes'].items())
+            lines.append(f'{row["lf"][:39]:<40}{row["calls"]:>9}{row["seconds"]:>10.3f}'
+                         f'{row["share"]:>8.1%}{row["mean_us"]:>10.1f}{row["p50_us"]:>10.1f}'
+                         f'{row["p99_us"]:>10.1f}  {votes}')
+        return '\n'.join(lines)
+
+    def to_json(self, path=None):
+        """
+        The stats as a JSON string, also written to path if given
+        """
+        text = json.dumps({'docs': self.docs, 'unique_docs': self.unique_docs,
+                           'dedup_ratio': self.dedup_ratio, 'lfs': self.rows()}, indent=1)
+        if path is not None:
+            with open(path, 'w') as fout:
+                fout.write(text)
+        return text
+
+    def __str__(self):
+        return self.table()
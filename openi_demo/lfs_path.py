@@ -0,0 +1,17 @@
+"""
+Makes the shared LF helpers in ../lfs importable. Import this module
+before importing from them:
+
+    import lfs_path  # noqa: F401
+    from docview import as_doc
+"""
+import os
+import sys
+
+LFS_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'lfs'))
+
+# First on the path, so installed packages with generic names (patterns,
+# negation, ...) cannot shadow the helpers
+if LFS_DIR in sys.path:
+    sys.path.remove(LFS_DIR)
+sys.path.insert(0, LFS_DIR)
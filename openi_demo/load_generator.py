@@ -0,0 +1,90 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import time
+
+from lf_profile import LFStats
+
+DEFAULT_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'dev_entries.csv')
+
+async def request(reader, writer, host, method, path, payload=None):
+    """
+    Sends one HTTP/1.1 request on a kept-alive connection and returns the
+    decoded JSON response
+    """
+    body = b'' if payload is None else json.dumps(payload).encode('utf-8')
+    head = (f'{method} {path} HTTP/1.1\r\nHost: {host}\r\n'
+            f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n')
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, _, value = line.decode('latin-1').partition(':')
+        if key.strip().lower() == 'content-length':
+            length = int(value)
+    response = json.loads((await reader.readexactly(length)).decode('utf-8'))
+    if status != 200:
+        raise RuntimeError(f'{method} {path} failed with {status}: {response}')
+    return response
+
+async def client(host, port, texts, n_requests, latency):
+    """
+    Sends n_requests label requests back to back over one connection
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(n_requests):
+            start = time.perf_counter()
+            await request(reader, writer, host, 'POST', '/label', {'text': random.choice(texts)})
+            latency.record(time.perf_counter() - start, None)
+    finally:
+        writer.close()
+
+async def run_load(host, port, texts, n_requests, concurrency):
+    """
+    Labels n_requests reports from concurrency simultaneous clients;
+    returns client-side and server-side stats
+    """
+    latency = LFStats()
+    per_client = [n_requests // concurrency + (i < n_requests % concurrency)
+                  for i in range(concurrency)]
+    start = time.perf_counter()
+    await asyncio.gather(*[client(host, port, texts, n, latency) for n in per_client if n])
+    seconds = time.perf_counter() - start
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        server_stats = await request(reader, writer, host, 'GET', '/stats')
+    finally:
+        writer.close()
+    return {
+        'requests': latency.calls,
+        'concurrency': concurrency,
+        'seconds': seconds,
+        'requests_per_second': latency.calls / seconds if seconds else 0.0,
+        'latency_p50_ms': 1e3 * latency.quantile(0.5),
+        'latency_p99_ms': 1e3 * latency.quantile(0.99),
+        'server': server_stats,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load generator for labeling_service.py')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--csv', default=DEFAULT_CSV, help='CSV whose text column is sent')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    with open(args.csv) as fin:
+        texts = [row['text'] for row in csv.DictReader(fin)]
+    results = asyncio.run(run_load(args.host, args.port, texts, args.requests, args.concurrency))
+    print(json.dumps(results, indent=1))
@@ -1,4 +1,8 @@
+import json
 import os
+import random
+import warnings
+from functools import lru_cache, partial
 import numpy as np
 import torch
 import torchvision.transforms as transforms
@@ -12,6 +16,40 @@ def load_ids(filename):
     fin = open(filename, "r")
     return [_.strip() for _ in fin]
 
+@lru_cache(maxsize=4)
+def _read_front_view_index(path, mtime):
+    return frozenset(load_ids(path))
+
+def load_front_view_index(filename="./data/front_view_ids.txt"):
+    """
+    Front-view image ids as a frozenset, read again only when the file
+    (resolved against the current directory) changes
+    """
+    path = os.path.abspath(filename)
+    return _read_front_view_index(path, os.path.getmtime(path))
+
+def choose_front_view(candidates, ref):
+    """
+    First of a study's candidate image paths that is a front view in ref
+    (by path or file name), else its last candidate
+    """
+    impath = None
+    for impath in candidates:
+        if impath in ref or os.path.basename(impath) in ref:
+            break
+    return impath
+
+def resolve_image_paths(paths, ref=None):
+    """
+    Image path used for each study: per-study candidate lists are resolved
+    against ref with choose_front_view. Datasets resolve their paths once
+    and keep the result.
+    """
+    if ref is None:
+        return paths
+    ref = ref if isinstance(ref, frozenset) else frozenset(ref)
+    return [choose_front_view(p, ref) if isinstance(p, list) else p for p in paths]
+
 class StdNormalize(object):
     """
     Normalize torch tensor to have zero mean and unit std deviation
@@ -40,29 +78,195 @@ def default_xray_loader(xray_path, img_rows=224, img_cols=224):
     xray = array_to_img(xray, "channels_last")
     return xray
 
+def load_xray_uint8(xray_path, img_rows=224, img_cols=224, input_size=None):
+    """
+    Grayscale uint8 pixels of default_xray_loader's image, computed on a
+    single channel: decoded, resized to (img_rows, img_cols) and rescaled
+    to [0, 255] exactly as array_to_img does, then optionally resized to
+    input_size as transform() does
+    """
+    xray = load_img(xray_path, color_mode="grayscale", target_size=(img_rows, img_cols))
+    # array_to_img's rescale, in float32 with the same truncation
+    x = np.asarray(xray, dtype="float32")
+    x_max = x.max()
+    if x_max != 0:
+        x /= x_max
+    x *= 255
+    xray = pil_image.fromarray(x.astype("uint8"), "L")
+    if input_size is not None:
+        xray = transforms.Resize(input_size)(xray)
+    # Writable, so torch.from_numpy can share it
+    return np.array(xray, dtype=np.uint8)
+
+def normalize_xrays_(xrays):
+    """
+    Normalizes a (B, H, W) float batch of [0, 1] grayscale X-rays in place,
+    each exactly as StdNormalize normalizes its 3-channel image
+    """
+    flat = xrays.view(len(xrays), -1)
+    flat.sub_(flat.mean(1, keepdim=True))
+    # Unbiased std over the 3 identical channels StdNormalize sees
+    n = flat.shape[1]
+    flat.div_(flat.norm(dim=1, keepdim=True).mul_((3.0 / (3 * n - 1)) ** 0.5))
+    return xrays
+
+def xray_tensor_from_uint8(pixels):
+    """
+    Turns an (H, W) uint8 grayscale X-ray into the same normalized tensor
+    as transform() applied to its 3-channel image. Only one channel is
+    computed; the 3 channels are an expand view of it.
+    """
+    xray = torch.from_numpy(pixels).float().div_(255)
+    normalize_xrays_(xray.unsqueeze(0))
+    return xray.unsqueeze(0).expand(3, *xray.shape)
+
+def collate_normalize(batch):
+    """
+    DataLoader collate_fn for datasets returning (uint8 X-ray, label):
+    stacks the uint8 images into one batch, normalizes it in place with
+    per-image statistics and returns (B, 3, H, W) images and the labels
+    """
+    xrays, ys = zip(*batch)
+    xrays = torch.stack(xrays).float().div_(255)
+    normalize_xrays_(xrays)
+    ys = torch.utils.data.dataloader.default_collate(ys)
+    return xrays.unsqueeze(1).expand(-1, 3, -1, -1), ys
+
+def fast_xray_loader(xray_path, input_size=224, img_rows=224, img_cols=224):
+    """
+    default_xray_loader followed by transform(input_size), without the
+    float and 3-channel intermediate copies
+    """
+    return xray_tensor_from_uint8(load_xray_uint8(xray_path, img_rows, img_cols, input_size))
+
+def iter_xray_paths(paths):
+    """
+    Yields every distinct image path, flattening per-study path lists
+    """
+    seen = set()
+    for entry in paths:
+        for path in (entry if isinstance(entry, list) else [entry]):
+            if path not in seen:
+                seen.add(path)
+                yield path
+
+class XrayCache(object):
+    """
+    X-rays decoded and resized once, stored as uint8 grayscale in a single
+    memory-mapped <cache_path>.npy, with a path -> row index in
+    <cache_path>.json.
+
+    The memmap is opened copy-on-write, so rows are handed to torch
+    without copying and pages are shared between DataLoader workers.
+    """
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.images = np.load(cache_path + ".npy", mmap_mode="c")
+        with open(cache_path + ".json", "r") as fin:
+            self.index = json.load(fin)
+
+    def __getstate__(self):
+        # Workers started with spawn reopen the memmap instead of copying it
+        return self.cache_path
+
+    def __setstate__(self, cache_path):
+        self.__init__(cache_path)
+
+    @classmethod
+    def exists(cls, cache_path):
+        return os.path.exists(cache_path + ".npy") and os.path.exists(cache_path + ".json")
+
+    @classmethod
+    def build(cls, paths, cache_path, input_size=224, loader=default_xray_loader, base=None, ref=None):
+        """
+        Decodes every image in paths (only each study's front view if ref
+        is given, as CXRFileList resolves them) with loader, resizes it to
+        input_size and writes the uint8 cache. Given base, an XrayCache of
+        the same input_size, the cache is extended instead: it holds base's
+        images, copied rather than decoded again, followed by the new ones.
+        """
+        paths = list(iter_xray_paths(resolve_image_paths(paths, ref)))
+        if base is not None:
+            paths = list(base.index) + [path for path in paths if path not in base]
+        resize = transforms.Resize(input_size)
+        # Written next to the cache and swapped in, as base may map it
+        tmp_path = cache_path + ".tmp.npy"
+        images = None
+        index = {}
+        for row, path in enumerate(paths):
+            if base is not None and path in base:
+                pixels = base.pixels(path)
+            elif loader is default_xray_loader:
+                pixels = load_xray_uint8(path, input_size=input_size)
+            else:
+                # All three channels of the loaded image are identical
+                pixels = np.asarray(resize(loader(path)), dtype=np.uint8)[:, :, 0]
+            if images is None:
+                images = np.lib.format.open_memmap(
+                    tmp_path, mode="w+", dtype=np.uint8, shape=(len(paths),) + pixels.shape
+                )
+            images[row] = pixels
+            index[path] = row
+        if images is None:
+            np.save(tmp_path, np.zeros((0, input_size, input_size), dtype=np.uint8))
+        else:
+            images.flush()
+            del images
+        if os.path.exists(cache_path + ".json"):
+            os.remove(cache_path + ".json")
+        os.replace(tmp_path, cache_path + ".npy")
+        # Index written last, so a cache with an index is complete
+        with open(cache_path + ".json", "w") as fout:
+            json.dump(index, fout)
+        return cls(cache_path)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, path):
+        return path in self.index
+
+    def pixels(self, path):
+        """
+        (H, W) uint8 view of the cached image
+        """
+        return self.images[self.index[path]]
+
+    def tensor(self, path):
+        """
+        Normalized 3-channel tensor of the cached image
+        """
+        return xray_tensor_from_uint8(self.pixels(path))
+
 
 class CXRFileList(torch.utils.data.Dataset):
-    def __init__(self, paths, label=None, transform=None, loader=default_xray_loader, ref=None, lfs=None, slice_mode=None, get_slice_labels=False):
+    def __init__(self, paths, label=None, transform=None, loader=default_xray_loader, ref=None, lfs=None, slice_mode=None, get_slice_labels=False, cache=None, raw=False):
         self.paths = paths
         self.label = label
         self.transform = transform
         self.loader = loader
         self.ref = ref
+        # Image path used for each study, resolved once against a hashed ref
+        self.impaths = resolve_image_paths(paths, ref)
+        # XrayCache replacing loader and transform for the images it holds
+        self.cache = cache
+        # Whether to return uint8 (H, W) images from a uint8 loader, leaving
+        # normalization to collate_normalize
+        self.raw = raw
         # Note: slice_labels and labels in same order!
         if lfs is not None:
             self.lfs = torch.from_numpy(np.array(lfs).astype(np.float32))
 
     def __getitem__(self, index):
-        idx = 0
-        if self.ref is not None and isinstance(self.paths[index],list):
-            for i in range(len(self.paths[index])):
-                impath = self.paths[index][i]
-                if impath in self.ref:
-                    idx=i
-                    break
-        else:
-            impath = self.paths[index]
+        impath = self.impaths[index]
         y = self.label[index]
+        if self.raw:
+            if self.cache is not None and impath in self.cache:
+                return torch.from_numpy(self.cache.pixels(impath)), y
+            return torch.from_numpy(self.loader(impath)), y
+        if self.cache is not None and impath in self.cache:
+            return self.cache.tensor(impath), y
         img = self.loader(impath)
         if self.transform is not None:
             img = self.transform(img)
@@ -70,25 +274,127 @@ class CXRFileList(torch.utils.data.Dataset):
 
     def __len__(self):
         return len(self.paths)
-    
+
+    def warm_up(self):
+        """
+        Per-worker setup done before the first sample is requested
+        """
+        if pil_image is not None:
+            # Registers the image decoders up front
+            pil_image.init()
+
+def default_num_workers():
+    """
+    DataLoader workers to use: every available core but one, which is
+    left to the training process
+    """
+    try:
+        n_cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        n_cores = os.cpu_count() or 1
+    return max(n_cores - 1, 0)
+
+def seed_worker(worker_id):
+    """
+    DataLoader worker_init_fn: seeds numpy and random from the worker's
+    torch seed, limits intra-op threads to one per worker and warms up the
+    dataset
+    """
+    seed = torch.initial_seed() % 2 ** 32
+    np.random.seed(seed)
+    random.seed(seed)
+    torch.set_num_threads(1)
+    dataset = torch.utils.data.get_worker_info().dataset
+    if hasattr(dataset, "warm_up"):
+        dataset.warm_up()
+
 def get_data_loader(
     paths, 
     labels, 
     batch_size=32, 
     input_size=224,
     shuffle=False,
+    cache_path=None,
+    shard_dir=None,
+    fast=False,
+    batch_normalize=False,
+    num_workers=None,
+    pin_memory=None,
+    persistent_workers=False,
+    prefetch_factor=None,
+    worker_init_fn=seed_worker,
 ):
     # Load front image index
-    fin=open('./data/front_view_ids.txt', "r")
-    front_view_ids = [_.strip() for _ in fin]
-    fin.close()
+    front_view_ids = load_front_view_index('./data/front_view_ids.txt')
 
-    dataset = CXRFileList(
+    # Decode images once into a uint8 memmap, reused by later runs
+    cache = None
+    if cache_path is not None:
+        if shard_dir is not None:
+            raise ValueError("cache_path and shard_dir are exclusive: sharded images are read from their shards")
+        # Only the image the dataset reads for each study
+        impaths = resolve_image_paths(paths, front_view_ids)
+        if XrayCache.exists(cache_path):
+            cache = XrayCache(cache_path)
+        if cache is None or cache.images.shape[1:] != (input_size, input_size):
+            cache = XrayCache.build(impaths, cache_path, input_size=input_size)
+        elif not all(path in cache for path in iter_xray_paths(impaths)):
+            # Built for other images: add the missing ones
+            cache = XrayCache.build(impaths, cache_path, input_size=input_size, base=cache)
+
+    if batch_normalize:
+        # Workers only decode to uint8; normalization happens per batch
+        loader, xray_transform = partial(load_xray_uint8, input_size=input_size), None
+    elif fast:
+        # Single-channel loader producing transform()'s output directly
+        loader, xray_transform = partial(fast_xray_loader, input_size=input_size), None
+    else:
+        loader, xray_transform = default_xray_loader, transform(input_size)
+
+    if shard_dir is not None:
+        # Stream the images sequentially from xray_shards.pack_xray_shards'
+        # shards; the dataset shuffles shards and samples itself
+        from xray_shards import ShardedCXRDataset
+        dataset = ShardedCXRDataset(
+            shard_dir,
             paths=paths,
             label=labels,
-            transform=transform(input_size),
+            transform=xray_transform,
+            loader=loader,
             ref=front_view_ids,
+            raw=batch_normalize,
+            shuffle=shuffle,
         )
+        shuffle = False
+    else:
+        dataset = CXRFileList(
+            paths=paths,
+            label=labels,
+            transform=xray_transform,
+            loader=loader,
+            ref=front_view_ids,
+            cache=cache,
+            raw=batch_normalize,
+        )
+
+    # Decode in parallel worker processes, prefetching batches ahead of
+    # the training loop
+    if num_workers is None:
+        num_workers = default_num_workers()
+    if pin_memory is None:
+        pin_memory = torch.cuda.is_available()
+    if shard_dir is not None and num_workers > len(dataset.index.shards):
+        # Workers sharing a shard each read all of it
+        warnings.warn(f"{num_workers} workers for {len(dataset.index.shards)} shards in {shard_dir}; "
+                      "pack smaller shards to use every worker fully")
+    worker_kwargs = {}
+    if num_workers > 0:
+        worker_kwargs["worker_init_fn"] = worker_init_fn
+        # Off by default: idle workers of every loader would otherwise hold
+        # their processes and memory between epochs, and loaders share cores
+        worker_kwargs["persistent_workers"] = persistent_workers
+        if prefetch_factor is not None:
+            worker_kwargs["prefetch_factor"] = prefetch_factor
 
     # Build data loader
     data_loader = torch.utils.data.DataLoader(
@@ -96,6 +402,10 @@ def get_data_loader(
         sampler=None,
         batch_size=batch_size,
         shuffle=shuffle,
+        collate_fn=collate_normalize if batch_normalize else None,
+        num_workers=num_workers,
+        pin_memory=pin_memory,
+        **worker_kwargs
     )
     
     return data_loader 
@@ -0,0 +1,245 @@
+import argparse
+import io
+import json
+import os
+import random
+import tarfile
+
+import torch
+
+from utils import (default_xray_loader, iter_xray_paths, load_front_view_index, pil_image,
+                   resolve_image_paths)
+
+# Encoded image bytes per shard before a new one is started
+DEFAULT_SHARD_BYTES = 256 * 2 ** 20
+
+# Samples held back for in-shard shuffling
+DEFAULT_SHUFFLE_BUFFER = 1000
+
+# Read size of the sequential shard reads
+READ_BUFFER_BYTES = 2 ** 22
+
+INDEX_FILE = 'index.json'
+
+######################################################################################################
+##### PACKING
+######################################################################################################
+
+def _write_index(out_dir, index):
+    tmp = os.path.join(out_dir, INDEX_FILE + '.tmp')
+    with open(tmp, 'w') as fout:
+        json.dump(index, fout)
+    os.replace(tmp, os.path.join(out_dir, INDEX_FILE))
+
+def pack_xray_shards(paths, out_dir, ref=None, shard_bytes=DEFAULT_SHARD_BYTES):
+    """
+    Packs the image files a split uses (each study's front view if ref is
+    given, as CXRFileList resolves them) into tar shards of about
+    shard_bytes each, stored unchanged in split order. index.json, written
+    last, maps every image path to its shard and the offset and size of
+    its bytes there, so images can also be read without scanning a shard.
+
+    Returns the ShardIndex.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    index = {'shards': [], 'images': []}
+    tar = None
+    for path in iter_xray_paths(resolve_image_paths(paths, ref)):
+        if tar is None or tar.offset >= shard_bytes:
+            if tar is not None:
+                tar.close()
+            shard = {'file': f'xrays_{len(index["shards"]):05d}.tar', 'n_images': 0}
+            index['shards'].append(shard)
+            tar = tarfile.open(os.path.join(out_dir, shard['file']), 'w', format=tarfile.USTAR_FORMAT)
+        # Members are named by image number; the index holds their paths
+        info = tarfile.TarInfo(f'{len(index["images"]):08d}{os.path.splitext(path)[1]}')
+        info.size = os.path.getsize(path)
+        offset = tar.offset + len(info.tobuf(tar.format, tar.encoding, tar.errors))
+        with open(path, 'rb') as fin:
+            tar.addfile(info, fin)
+        index['images'].append([path, len(index['shards']) - 1, offset, info.size])
+        shard['n_images'] += 1
+    if tar is not None:
+        tar.close()
+    _write_index(out_dir, index)
+    return ShardIndex(out_dir)
+
+
+class ShardIndex(object):
+    """
+    The index.json of a shard directory written by pack_xray_shards
+    """
+
+    def __init__(self, shard_dir):
+        self.shard_dir = shard_dir
+        with open(os.path.join(shard_dir, INDEX_FILE)) as fin:
+            index = json.load(fin)
+        self.shards = [os.path.join(shard_dir, shard['file']) for shard in index['shards']]
+        self.images = index['images']
+        self.rows = {path: row for row, (path, _, _, _) in enumerate(self.images)}
+
+    def __len__(self):
+        return len(self.images)
+
+    def __contains__(self, path):
+        return path in self.rows
+
+    def read(self, path):
+        """
+        Encoded bytes of one image, read directly at its offset
+        """
+        _, shard, offset, size = self.images[self.rows[path]]
+        with open(self.shards[shard], 'rb') as fin:
+            fin.seek(offset)
+            return fin.read(size)
+
+######################################################################################################
+##### STREAMING DATASET
+######################################################################################################
+
+class ShardedCXRDataset(torch.utils.data.IterableDataset):
+    """
+    Streams the samples of a split from the shards of pack_xray_shards,
+    returning what CXRFileList returns for them. Every shard is read once
+    per epoch, front to back.
+
+    With shuffle, the shard order is shuffled every epoch and samples pass
+    through a buffer of buffer_size from which they are drawn at random,
+    which mixes samples across neighbouring shards. DataLoader workers
+    each stream a disjoint subset of the shards; with more workers than
+    shards, the workers sharing a shard each keep an interleaved part of
+    its images (every worker still reads the whole shard).
+    """
+
+    def __init__(self, shard_dir, paths, label=None, transform=None, loader=default_xray_loader,
+                 ref=None, raw=False, shuffle=False, buffer_size=DEFAULT_SHUFFLE_BUFFER, seed=0):
+        self.index = ShardIndex(shard_dir)
+        self.paths = paths
+        self.label = label
+        self.transform = transform
+        self.loader = loader
+        self.raw = raw
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.seed = seed
+        self.epoch = 0
+        # Samples showing each packed image, by image number
+        self.samples = {}
+        missing = 0
+        for sample, impath in enumerate(resolve_image_paths(paths, ref)):
+            if impath in self.index:
+                self.samples.setdefault(self.index.rows[impath], []).append(sample)
+            else:
+                missing += 1
+        if missing:
+            raise ValueError(f'{missing} images of the split are not in the shards of {shard_dir}')
+
+    def __len__(self):
+        return len(self.paths)
+
+    def set_epoch(self, epoch):
+        """
+        Picks the shard order and shuffle of an epoch; otherwise each pass
+        over the dataset starts the next epoch
+        """
+        self.epoch = epoch
+
+    def warm_up(self):
+        """
+        Per-worker setup done before the first sample is requested
+        """
+        if pil_image is not None:
+            pil_image.init()
+
+    def _worker_shards(self, epoch):
+        """
+        ((shard, part, n_parts) to read, worker id, epoch seed) of the
+        calling worker, which keeps the images of a shard whose position
+        in it is part modulo n_parts
+        """
+        shards = list(range(len(self.index.shards)))
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id, num_workers, base_seed = 0, 1, 0
+        if worker_info is not None:
+            # Shared by the workers of one DataLoader iterator
+            worker_id, num_workers = worker_info.id, worker_info.num_workers
+            base_seed = worker_info.seed - worker_info.id
+        epoch_seed = f'{self.seed}-{epoch}-{base_seed}'
+        if self.shuffle:
+            # Same order in every worker, so their subsets do not overlap
+            random.Random(epoch_seed).shuffle(shards)
+        if num_workers <= len(shards):
+            return [(shard, 0, 1) for shard in shards[worker_id::num_workers]], worker_id, epoch_seed
+        if not shards:
+            return [], worker_id, epoch_seed
+        # Worker w takes part w // len(shards) of shard w % len(shards)
+        shard = shards[worker_id % len(shards)]
+        n_parts = len(range(worker_id % len(shards), num_workers, len(shards)))
+        return [(shard, worker_id // len(shards), n_parts)], worker_id, epoch_seed
+
+    def _iter_shard(self, shard, part=0, n_parts=1):
+        """
+        (sample, encoded bytes) of the split's samples in the part of a
+        shard's images (see _worker_shards), read sequentially
+        """
+        with open(self.index.shards[shard], 'rb', buffering=READ_BUFFER_BYTES) as fin:
+            with tarfile.open(fileobj=fin, mode='r|') as tar:
+                for position, member in enumerate(tar):
+                    if position % n_parts != part:
+                        continue
+                    samples = self.samples.get(int(os.path.splitext(member.name)[0]))
+                    if samples is None:
+                        continue
+                    data = tar.extractfile(member).read()
+                    for sample in samples:
+                        yield sample, data
+
+    def _iter_shuffled(self, shards, rng):
+        buffer = []
+        for item in self._iter_shards(shards):
+            if len(buffer) < self.buffer_size:
+                buffer.append(item)
+                continue
+            idx = rng.randrange(len(buffer))
+            yield buffer[idx]
+            buffer[idx] = item
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def _iter_shards(self, shards):
+        for shard, part, n_parts in shards:
+            yield from self._iter_shard(shard, part, n_parts)
+
+    def __iter__(self):
+        epoch = self.epoch
+        # Each worker holds its own copy of the dataset and counts epochs
+        self.epoch += 1
+        shards, worker_id, epoch_seed = self._worker_shards(epoch)
+        if self.shuffle:
+            samples = self._iter_shuffled(shards, random.Random(f'{epoch_seed}-{worker_id}'))
+        else:
+            samples = self._iter_shards(shards)
+        for sample, data in samples:
+            y = self.label[sample]
+            if self.raw:
+                yield torch.from_numpy(self.loader(io.BytesIO(data))), y
+                continue
+            img = self.loader(io.BytesIO(data))
+            if self.transform is not None:
+                img = self.transform(img)
+            yield img, y
+
+if __name__ == '__main__':
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description='Pack the X-rays of a split into tar shards')
+    parser.add_argument('csv', help='split CSV with an xray_paths column, e.g. data/train_entries.csv')
+    parser.add_argument('out', help='shard directory, e.g. data/xray_shards/train')
+    parser.add_argument('--shard-mb', type=int, default=DEFAULT_SHARD_BYTES // 2 ** 20)
+    parser.add_argument('--front-view-ids', default='./data/front_view_ids.txt')
+    args = parser.parse_args()
+
+    paths = pd.read_csv(args.csv, usecols=['xray_paths'])['xray_paths'].tolist()
+    shards = pack_xray_shards(paths, args.out, ref=load_front_view_index(args.front_view_ids),
+                              shard_bytes=args.shard_mb * 2 ** 20)
+    print(f'{len(shards)} images in {len(shards.shards)} shards under {args.out}')